@@ -1,12 +1,18 @@
 import time
+from time import perf_counter_ns
 from djitellopy import tello
 from threading import Thread
 from logger import Logger
+from instrumentation import metrics, StartupTimer
 import keyboard  
 
 class MinimalSubscriber:
 
-    def __init__(self):
+    def __init__(self, startup=None):
+        """
+        @startup : a StartupTimer to record the phases into (the launcher passes its own).
+        """
+        self.startup = startup or StartupTimer()
 
         self.kp = 0.8  # Proportional gain
         self.ki = 0.1 # Integral gain
@@ -14,20 +20,35 @@ class MinimalSubscriber:
         self.previous_error = 0
         self.integral = 0
 
-        # Initialize logger and command state
-        self.log = Logger("log1.csv")
+        # Initialize logger and command state, the gains are kept with the archived flight
+        self.log = Logger("log1.csv", gains={'kp': self.kp, 'ki': self.ki, 'kd': self.kd})
         self.command = "stand"
         self.initial_yaw = None  # Variable to store the initial yaw
 
         # Connect to the Drone
         self.me = tello.Tello()
         self.me.connect()
+        self.startup.mark("connect")
 
         # Print the Battery percentage
-        print("Battery percentage:", self.me.get_battery())
+        battery = self.me.get_battery()
+        print("Battery percentage:", battery)
 
-        if self.me.get_battery() < 10:
+        if battery < 10:
             raise RuntimeError("Tello rejected attempt to takeoff due to low battery")
+        self.startup.mark("battery check")
+
+        # live metrics on http://127.0.0.1:8765/, a debug page must not keep the drone from flying
+        try:
+            metrics.serve()
+        except OSError as e:
+            print("Metrics page not started:", e)
+
+        # Log every state packet of the flight
+        self.log_thread = Thread(target=self.log_update, daemon=True)
+        self.log_thread.start()
+        self.startup.mark("log thread")
+        print(self.startup.report())
 
         # Start the sequence
         self.takeoff_and_execute_sequence()
@@ -65,6 +86,9 @@ class MinimalSubscriber:
         self.me.land()
         self.command = "landed"
         print("Landed successfully.")
+        self.log.save_log()
+        metrics.dump("metrics1.txt")
+        print("Log saved successfully!")
 
     def rotate_to_yaw_pid(self, target_yaw):
         """
@@ -72,9 +96,12 @@ class MinimalSubscriber:
         """
         current_yaw = self.me.get_yaw()
         previous_time = time.time()
+        # logged, so the archive can measure the overshoot after each turn
+        self.command = "YAW PID"
         time.sleep(0.1)
 
         while abs(current_yaw - target_yaw) > 1:  # Small tolerance for reaching exact yaw
+            tick = perf_counter_ns()
             current_yaw = self.me.get_yaw()
 
             # Calculate error
@@ -106,7 +133,9 @@ class MinimalSubscriber:
             print(yaw_speed)
 
             # Apply the control
-            self.me.send_rc_control(0, 0, 0, int(yaw_speed))
+            with metrics.span("rc"):
+                self.me.send_rc_control(0, 0, 0, int(yaw_speed))
+            metrics.record("pid", perf_counter_ns() - tick)
 
             time.sleep(0.1)
             if keyboard.is_pressed('esc'):
@@ -114,7 +143,9 @@ class MinimalSubscriber:
                 self.me.land()
                 break
 
-        self.me.send_rc_control(0, 0, 0, 0)  # Stop rotation
+        with metrics.span("rc"):
+            self.me.send_rc_control(0, 0, 0, 0)  # Stop rotation
+        self.command = "stand"
         print(f"Reached target yaw: {target_yaw} degrees")
 
     def keyboard_control(self):
@@ -132,10 +163,14 @@ class MinimalSubscriber:
         """   
         Update the state of the drone into the log file.
         """
+        last = None
         while True:
             state = self.me.get_current_state()
-            if len(state) == 21:
+            # one row per state packet, djitellopy builds a new dict for each
+            if state is not last and len(state) == 21:
                 self.log.add(state, self.command, 0)
+                last = state
+            time.sleep(0.005)
 
 if __name__ == '__main__':
     tello = MinimalSubscriber()
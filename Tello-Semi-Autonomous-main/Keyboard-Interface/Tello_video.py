@@ -1,31 +1,38 @@
 from threading import Thread
 from queue import Queue
 from djitellopy import tello
+from time import perf_counter_ns, time
+from instrumentation import metrics
 
 
 class FileVideoStreamTello:
 
-    def __init__(self, tello: tello.Tello, queuesize=4):
+    def __init__(self, tello: tello.Tello, queuesize=4, pool=None):
         """
             Initialize.
             @tello : the drone itself.
             @queuesize : the maximum number of frames the queue can hold.
                         Default - 128
+            @pool : a FramePool. If given, decoded frames are copied into its
+                    buffers and read() returns Frame objects that must be released.
         """
         self.tello = tello
         self.tello.streamon()
 
         self.stopped = False
+        self.pool = pool
+        self.frame_number = 0
 
         self.q = Queue(maxsize=queuesize)
+        self.thread = None
 
     def start(self):
         """
             Starts the deamon thread.
         """
-        t = Thread(target=self.update, args=())
-        # t.deamon = True
-        t.start()
+        self.thread = Thread(target=self.update, args=(), name="capture")
+        self.thread.daemon = True
+        self.thread.start()
 
         return self
 
@@ -35,20 +42,32 @@ class FileVideoStreamTello:
             and decode them.
         """
 
-        while True:
+        while not self.stopped:
+            if not self.q.full():
+                # make sure the queue isnt full
+                start = perf_counter_ns()
+                frame = self.tello.get_frame_read().frame
+                stamp = time()
+                grabbed = self.tello.get_frame_read().grabbed
 
-            if not self.stopped:
+                if not grabbed:
+                    metrics.count("capture.fail")
+                    print("fail")
+                    return
+                
+                if self.pool is not None:
+                    buf = self.pool.acquire(frame.shape)
+                    if buf is None:
+                        # every buffer is still in use downstream
+                        metrics.count("capture.dropped")
+                        continue
+                    buf.load(frame, self.frame_number, stamp)
+                    frame = buf
 
-                if not self.q.full():
-                    # make sure the queue isnt full
-                    frame = self.tello.get_frame_read().frame
-                    grabbed = self.tello.get_frame_read().grabbed
-
-                    if not grabbed:
-                        print("fail")
-                        return
-                    
-                    self.q.put(frame)
+                self.frame_number += 1
+                self.q.put(frame)
+                metrics.record("capture", perf_counter_ns() - start)
+                metrics.count("capture.frames")
 
     def read(self):
         """
@@ -58,9 +77,11 @@ class FileVideoStreamTello:
 
     def stop(self):
         """
-            Stops the reading from the drone
+            Stops the reading from the drone, and waits for the capture thread to end.
         """
         self.stopped = True
+        if self.thread is not None:
+            self.thread.join()
     
     def more(self):
         """
@@ -0,0 +1,377 @@
+"""
+Headless benchmarks for the vision, logging and control hot paths.
+
+    python benchmark.py                      # run everything, write bench/<commit>.json
+    python benchmark.py --only detect logger
+    python benchmark.py --compare bench/a.json bench/b.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from time import perf_counter, perf_counter_ns
+
+import numpy as np
+
+RESOLUTIONS = [(320, 240), (640, 480), (960, 720)]
+MARKER_COUNTS = [0, 1, 4, 16]
+
+
+def synthetic_frame(width, height, n_markers, seed=0):
+    """
+        Returns a gray-ish BGR frame with n Aruco markers (DICT_4X4_100) on a grid.
+    """
+    import cv2
+    rng = np.random.default_rng(seed)
+    img = rng.integers(90, 160, size=(height, width, 3), dtype=np.uint8)
+    if n_markers == 0:
+        return img
+    aruco_dict = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_100)
+    side = int(np.ceil(np.sqrt(n_markers)))
+    cell = min(width, height) // side
+    size = int(cell * 0.6)
+    for i in range(n_markers):
+        r, c = divmod(i, side)
+        marker = cv2.aruco.drawMarker(aruco_dict, i, size)
+        # straight onto the background: the black border is contrast enough,
+        # while a thin white margin on gray makes the detector miss the marker
+        y0, x0 = r * cell + (cell - size) // 2, c * cell + (cell - size) // 2
+        img[y0:y0 + size, x0:x0 + size] = marker[:, :, None]
+    return img
+
+
+def _check_found(found, n, width, height):
+    """
+        A case that misses markers would time the background noise only.
+    """
+    if found != n:
+        raise RuntimeError("synthetic %dx%d frame: %d of %d markers detected" % (width, height, found, n))
+
+
+def _summary(samples_ns):
+    # every sample is at hand, exact percentiles rather than histogram buckets
+    ms = np.asarray(samples_ns, dtype=np.float64) / 1e6
+    if len(ms) == 0:
+        return {'n': 0, 'mean_ms': 0.0, 'p50_ms': 0.0, 'p95_ms': 0.0, 'p99_ms': 0.0, 'max_ms': 0.0}
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {
+        'n': len(ms),
+        'mean_ms': float(ms.mean()),
+        'p50_ms': float(p50),
+        'p95_ms': float(p95),
+        'p99_ms': float(p99),
+        'max_ms': float(ms.max()),
+    }
+
+
+def bench_detect(duration):
+    """
+        Aruco detection FPS per resolution and marker count.
+    """
+    import cv2
+    from marker_detector import MarkerDetector
+    detector = MarkerDetector()
+    results = []
+    for width, height in RESOLUTIONS:
+        for n in MARKER_COUNTS:
+            img = synthetic_frame(width, height, n)
+            samples = []
+            found = 0
+            end = perf_counter() + duration
+            while perf_counter() < end:
+                start = perf_counter_ns()
+                gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+                ids, corners = detector.detect_gray(gray)
+                samples.append(perf_counter_ns() - start)
+                found = len(ids)
+            _check_found(found, n, width, height)
+            stats = _summary(samples)
+            stats.update(width=width, height=height, markers=n, found=found,
+                         fps=len(samples) / (sum(samples) / 1e9))
+            results.append(stats)
+    return results
+
+
+def bench_vision(frames):
+    """
+        Per-frame heap use of the copy-based video path against the pooled one.
+        NumPy reports its buffers to tracemalloc, OpenCV's own scratch memory is not seen.
+    """
+    import cv2
+    from frame_pool import FramePool
+    from marker_detector import MarkerDetector
+    src = synthetic_frame(960, 720, 4)
+    detector = MarkerDetector()
+    # the overlay is part of the cost, make sure there is one to draw
+    _check_found(len(detector.detect_gray(cv2.cvtColor(src, cv2.COLOR_BGR2GRAY))[0]), 4, 960, 720)
+
+    def legacy():
+        # what keyboardControl.video used to do
+        hud = src.copy()
+        gray = cv2.cvtColor(src, cv2.COLOR_BGR2GRAY)
+        corners, ids, _ = cv2.aruco.detectMarkers(gray, detector.dictionary, parameters=detector.parameters)
+        if ids is not None:
+            cv2.aruco.drawDetectedMarkers(hud, corners, ids)
+
+    pool = FramePool(count=2)
+
+    def pooled():
+        frame = pool.acquire(src.shape)
+        frame.load(src, 0)
+        ids, corners = detector.detect(frame)
+        detector.draw(frame.bgr, ids, corners)
+        frame.release()
+
+    results = {}
+    for name, step in (('copy', legacy), ('pool', pooled)):
+        step()  # warm up, the pool allocates here
+        tracemalloc.start()
+        peaks = []
+        samples = []
+        for _ in range(frames):
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            start = perf_counter_ns()
+            step()
+            samples.append(perf_counter_ns() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        stats = _summary(samples)
+        stats.update(peak_bytes_per_frame=float(np.mean(peaks)))
+        results[name] = stats
+    results['pool']['allocations'] = pool.stats()['allocations']
+    return results
+
+
+def bench_logger(rows):
+    """
+        Logger.add rows/sec and the memory held per row.
+    """
+    from logger import Logger
+    from sim_tello import SimTello
+    state = SimTello().get_current_state()
+    log = Logger(os.devnull)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    samples = []
+    # Logger.add prints every row, keep that out of the terminal but in the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(rows):
+            start = perf_counter_ns()
+            log.add(state, "stand", i)
+            samples.append(perf_counter_ns() - start)
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = _summary(samples)
+    stats.update(rows=rows, rows_per_s=rows / (sum(samples) / 1e9),
+                 bytes_per_row=(after - before) / rows, peak_bytes=peak - before)
+    return stats
+
+
+def bench_state(packets):
+    """
+        StateReceiver parse cost per packet, without the socket.
+    """
+    from sim_tello import SimTello
+    from state_receiver import StateReceiver, format_packet
+    packet = format_packet(SimTello().get_current_state())
+    rx = StateReceiver(capacity=1024)
+    start = perf_counter_ns()
+    for i in range(packets):
+        rx.parse(packet, i * 0.1)
+    elapsed = perf_counter_ns() - start
+    stats = rx.stats()
+    stats.update(packets_per_s=packets / (elapsed / 1e9))
+    return stats
+
+
+def bench_viewer(rows, renders=50):
+    """
+        Pyramid build time and render time of random windows over a long synthetic log.
+    """
+    import tempfile
+    import pandas as pd
+    from telemetry_viewer import CHANNELS, TelemetryView, build_pyramid
+    rng = np.random.default_rng(0)
+    t = 1.7e9 + np.arange(rows) * 0.01
+    df = pd.DataFrame({ch: np.cumsum(rng.normal(size=rows)).astype(np.float32) for ch in CHANNELS})
+    df['time'] = t
+    df['frame#'] = np.arange(rows) // 3
+    df['command'] = np.array(['stand', 'FORWARD', 'YAW LEFT'])[(np.arange(rows) // 5000) % 3]
+    with tempfile.TemporaryDirectory() as folder:
+        start = perf_counter()
+        path = build_pyramid(df, os.path.join(folder, 'log.csv'))
+        build = perf_counter() - start
+        view = TelemetryView(path)
+        samples = []
+        for _ in range(renders):
+            a, b = np.sort(rng.uniform(t[0], t[-1], 2))
+            start = perf_counter_ns()
+            view.render(a, b, 1200)
+            samples.append(perf_counter_ns() - start)
+    stats = _summary(samples)
+    stats.update(rows=rows, build_s=build)
+    return stats
+
+
+def bench_frame_queue(frames):
+    """
+        Latency from the decoder handing out a frame to video() reading it.
+    """
+    import Tello_video
+    from sim_tello import SimTello
+    # distinct frame objects so each stamp belongs to one frame
+    frames_src = [np.zeros((720, 960, 3), dtype=np.uint8) for _ in range(16)]
+    drone = SimTello(frames_src)
+    stream = Tello_video.FileVideoStreamTello(drone)
+    stream.start()
+    stamps = drone.get_frame_read().stamps
+    samples = []
+    for _ in range(frames):
+        frame = stream.read()
+        samples.append(int((perf_counter() - stamps[id(frame)]) * 1e9))
+        # simulate ~30 FPS consumer
+        time.sleep(1 / 30)
+    # joins the capture thread, so it does not spin into the next case
+    stream.stop()
+    stats = _summary(samples)
+    stats.update(frames=frames)
+    return stats
+
+
+def bench_control(duration):
+    """
+        Period jitter of RemoteControl+PID.py's own rotate_to_yaw_pid against the simulator,
+        turning back and forth between 0 and 90 degrees.
+    """
+    import types
+    from launcher import load
+    from sim_tello import SimTello
+    end = perf_counter() + duration
+    # is_pressed needs root on Linux; 'esc' is "pressed" once the time is up, which ends the turn
+    keys = types.SimpleNamespace(is_pressed=lambda key: key == 'esc' and perf_counter() > end)
+    real = sys.modules.get('keyboard')
+    sys.modules['keyboard'] = keys
+    try:
+        module = load('pid')
+    finally:
+        if real is None:
+            del sys.modules['keyboard']
+        else:
+            sys.modules['keyboard'] = real
+
+    # the constructor connects and flies, set up only what the turn uses
+    pid = module.MinimalSubscriber.__new__(module.MinimalSubscriber)
+    pid.me = SimTello()
+    pid.kp, pid.ki, pid.kd = 0.8, 0.1, 0.05
+    pid.previous_error, pid.integral = 0, 0
+    pid.command = "stand"
+
+    stamps = []
+    send = pid.me.send_rc_control
+
+    def timed_send(a, b, c, d):
+        stamps.append(perf_counter_ns())
+        send(a, b, c, d)
+
+    pid.me.send_rc_control = timed_send
+    target = 90
+    # the loop prints every tick, keep that out of the terminal but in the timing
+    with contextlib.redirect_stdout(io.StringIO()):
+        while perf_counter() < end:
+            pid.rotate_to_yaw_pid(target)
+            target = 90 - target
+    samples = np.diff(stamps)
+    # the sleep of every rotate_to_yaw_pid tick
+    period = 0.1
+    periods = samples / 1e6
+    stats = _summary(samples)
+    stats.update(rate_hz=1 / period, jitter_ms=float(np.std(periods)) if len(periods) else 0.0,
+                 worst_overrun_ms=float(periods.max() - period * 1e3) if len(periods) else 0.0)
+    return stats
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(old_file, new_file):
+    """
+        Print the ratio new/old of every numeric result.
+    """
+    with open(old_file) as f:
+        old = json.load(f)
+    with open(new_file) as f:
+        new = json.load(f)
+
+    def flat(prefix, value, out):
+        if isinstance(value, dict):
+            for k, v in value.items():
+                flat(prefix + "." + k if prefix else k, v, out)
+        elif isinstance(value, list):
+            for i, v in enumerate(value):
+                flat("%s[%d]" % (prefix, i), v, out)
+        elif isinstance(value, (int, float)):
+            out[prefix] = value
+        return out
+
+    a = flat("", old['results'], {})
+    b = flat("", new['results'], {})
+    print("%s -> %s" % (old['commit'], new['commit']))
+    for key in sorted(a.keys() & b.keys()):
+        if a[key]:
+            print("%-50s %12.3f %12.3f %7.2fx" % (key, a[key], b[key], b[key] / a[key]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', nargs='*', choices=['detect', 'vision', 'logger', 'state', 'viewer', 'queue', 'control'])
+    parser.add_argument('--duration', type=float, default=1.0, help="seconds per timed case")
+    parser.add_argument('--rows', type=int, default=2000, help="rows for the logger bench")
+    parser.add_argument('--out', default=None, help="output json (default bench/<commit>.json)")
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'))
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    only = set(args.only or ['detect', 'vision', 'logger', 'state', 'viewer', 'queue', 'control'])
+    results = {}
+    if 'detect' in only:
+        results['detect'] = bench_detect(args.duration)
+    if 'vision' in only:
+        results['vision'] = bench_vision(200)
+    if 'logger' in only:
+        results['logger'] = bench_logger(args.rows)
+    if 'state' in only:
+        results['state'] = bench_state(args.rows * 10)
+    if 'viewer' in only:
+        results['viewer'] = bench_viewer(1_000_000)
+    if 'queue' in only:
+        results['queue'] = bench_frame_queue(int(30 * args.duration) + 10)
+    if 'control' in only:
+        results['control'] = bench_control(max(args.duration, 2.0))
+
+    commit = _commit()
+    out = args.out or os.path.join('bench', commit + '.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump({'commit': commit, 'time': time.time(), 'python': sys.version.split()[0],
+                   'machine': platform.platform(), 'results': results}, f, indent=2)
+    print(json.dumps(results, indent=2))
+    print("Saved to", out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,226 @@
+"""
+Archive of every flight's Logger output, with a metadata index for fleet-wide queries.
+
+Layout:
+    archive/index.jsonl                          one metadata line per flight
+    archive/date=YYYY-MM-DD/<flight id>.npz      compressed columns of one flight
+
+Queries read the index first and then load only the columns they need,
+one flight at a time, so months of logs never sit in memory together.
+
+    python flight_archive.py ingest log1.csv --gains kp=0.8,ki=0.1,kd=0.05
+    python flight_archive.py list
+    python flight_archive.py battery
+    python flight_archive.py yaw-overshoot
+"""
+import argparse
+import datetime
+import json
+import os
+
+import numpy as np
+
+COLUMNS = ['time', 'frame#', 'pitch', 'roll', 'Yaw', 'height', 'Vx', 'Vy', 'Vz', 'battery']
+
+
+class FlightArchive:
+
+    def __init__(self, root='archive'):
+        """
+            Initialize.
+            @root : the directory of the archive.
+        """
+        self.root = root
+        self.index_path = os.path.join(root, 'index.jsonl')
+
+    def flights(self, since=None, until=None, **match):
+        """
+            Returns the metadata of the archived flights, oldest first.
+            @since, @until : 'YYYY-MM-DD' bounds on the flight date.
+            @match : metadata fields that must be equal, e.g. gains={'kp': 0.8, ...}.
+        """
+        if not os.path.exists(self.index_path):
+            return []
+        latest = {}
+        with open(self.index_path) as f:
+            for line in f:
+                if line.strip():
+                    meta = json.loads(line)
+                    # a flight ingested again replaces its older entry
+                    latest[meta['id']] = meta
+        result = []
+        for meta in latest.values():
+            if since and meta['date'] < since or until and meta['date'] > until:
+                continue
+            if any(meta.get(k) != v for k, v in match.items()):
+                continue
+            result.append(meta)
+        result.sort(key=lambda m: m['start'])
+        return result
+
+    def ingest(self, csv_path, gains=None, **extra):
+        """
+            Add a Logger csv to the archive. Returns its metadata.
+            @gains : the controller gains the flight was flown with, e.g. {'kp': 0.8}.
+            @extra : any other metadata to keep (pilot, notes...).
+        """
+        import pandas as pd
+        return self.ingest_frame(pd.read_csv(csv_path), csv_path, gains, **extra)
+
+    def ingest_frame(self, df, csv_path, gains=None, **extra):
+        """
+            Same as ingest, from the Logger data frame already in memory.
+            @csv_path : where the log was saved, kept as the flight's source.
+        """
+        if len(df) == 0:
+            raise ValueError("%s has no rows" % csv_path)
+
+        t = df['time'].to_numpy(dtype=np.float64)
+        start = datetime.datetime.fromtimestamp(t[0])
+        flight_id = start.strftime('%Y%m%d-%H%M%S')
+        date = start.strftime('%Y-%m-%d')
+
+        # stored as codes into a small vocabulary, a plain unicode array needs no pickling
+        commands, codes = np.unique(df['command'].astype(str).to_numpy().astype(str), return_inverse=True)
+        columns = {c: df[c].to_numpy(dtype=np.float32 if c != 'time' else np.float64) for c in COLUMNS}
+        columns['command'] = codes.astype(np.int16)
+        columns['commands'] = commands
+
+        folder = os.path.join(self.root, 'date=' + date)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, flight_id + '.npz')
+        np.savez_compressed(path, **columns)
+
+        battery = columns['battery']
+        meta = {
+            'id': flight_id,
+            'date': date,
+            'start': float(t[0]),
+            'duration_s': float(t[-1] - t[0]),
+            'rows': int(len(t)),
+            'battery_start': float(battery[0]),
+            'battery_end': float(battery[-1]),
+            'battery_drop': float(battery[0] - battery[-1]),
+            'commands': {str(c): int(n) for c, n in zip(commands, np.bincount(codes, minlength=len(commands)))},
+            'gains': gains,
+            'source': os.path.abspath(csv_path),
+            'path': os.path.relpath(path, self.root),
+        }
+        meta.update(extra)
+        with open(self.index_path, 'a') as f:
+            f.write(json.dumps(meta) + '\n')
+        return meta
+
+    def load(self, meta, columns):
+        """
+            Returns {column: array} of one flight, reading only the given columns.
+            'command' is returned decoded as strings.
+        """
+        with np.load(os.path.join(self.root, meta['path'])) as data:
+            out = {}
+            for c in columns:
+                if c == 'command':
+                    out[c] = data['commands'][data['command']]
+                else:
+                    out[c] = data[c]
+            return out
+
+    def scan(self, columns, **filters):
+        """
+            Yields (metadata, columns) flight by flight, for custom queries.
+        """
+        for meta in self.flights(**filters):
+            yield meta, self.load(meta, columns)
+
+    def battery_per_minute(self, **filters):
+        """
+            Battery drop per minute of flight, per flight and over all of them.
+            Only the index is read.
+        """
+        rows = []
+        drop = minutes = 0.0
+        for meta in self.flights(**filters):
+            m = meta['duration_s'] / 60
+            if m <= 0:
+                continue
+            rows.append((meta['id'], meta['battery_drop'] / m))
+            drop += meta['battery_drop']
+            minutes += m
+        return rows, drop / minutes if minutes else 0.0
+
+    def yaw_overshoot(self, window=2.0, **filters):
+        """
+            Yaw overshoot (degrees) after every yaw command, grouped by gain set.
+            The overshoot is how far the drone keeps turning, in the same
+            direction, within `window` seconds after the yaw command ends.
+        """
+        groups = {}
+        for meta, cols in self.scan(['time', 'Yaw', 'command'], **filters):
+            t = cols['time']
+            yaw = np.degrees(np.unwrap(np.radians(cols['Yaw'].astype(np.float64))))
+            turning = np.char.startswith(cols['command'].astype(str), 'YAW')
+            # indices where a yaw command has just ended
+            ends = np.flatnonzero(turning[:-1] & ~turning[1:]) + 1
+            if len(ends) == 0:
+                continue
+            starts = np.flatnonzero(turning[1:] & ~turning[:-1]) + 1
+            stops = np.searchsorted(t, t[ends] + window)
+            key = json.dumps(meta.get('gains'), sort_keys=True)
+            values = groups.setdefault(key, [])
+            for end, stop in zip(ends, stops):
+                begin = starts[starts < end]
+                begin = begin[-1] if len(begin) else 0
+                direction = np.sign(yaw[end] - yaw[begin])
+                if direction == 0 or stop <= end:
+                    continue
+                past = (yaw[end:stop] - yaw[end]) * direction
+                values.append(max(0.0, float(past.max())))
+        return {k: {'count': len(v), 'mean': float(np.mean(v)) if v else 0.0,
+                    'max': float(np.max(v)) if v else 0.0} for k, v in groups.items()}
+
+
+def _gains(text):
+    gains = {}
+    for part in text.split(','):
+        name, value = part.split('=')
+        gains[name] = float(value)
+    return gains
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default='archive')
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    ingest = sub.add_parser('ingest')
+    ingest.add_argument('csv', nargs='+')
+    ingest.add_argument('--gains', type=_gains, default=None, help="e.g. kp=0.8,ki=0.1,kd=0.05")
+    for name in ('list', 'battery', 'yaw-overshoot'):
+        q = sub.add_parser(name)
+        q.add_argument('--since', default=None, help="YYYY-MM-DD")
+        q.add_argument('--until', default=None, help="YYYY-MM-DD")
+    args = parser.parse_args()
+
+    archive = FlightArchive(args.root)
+    if args.cmd == 'ingest':
+        for path in args.csv:
+            meta = archive.ingest(path, gains=args.gains)
+            print("Archived %s as %s (%d rows, %.0f s)" % (path, meta['id'], meta['rows'], meta['duration_s']))
+        return
+
+    filters = {'since': args.since, 'until': args.until}
+    if args.cmd == 'list':
+        for meta in archive.flights(**filters):
+            print("%s %6.0f s  battery %3.0f -> %3.0f  gains %s" % (
+                meta['id'], meta['duration_s'], meta['battery_start'], meta['battery_end'], meta.get('gains')))
+    elif args.cmd == 'battery':
+        rows, overall = archive.battery_per_minute(**filters)
+        for flight_id, rate in rows:
+            print("%s %.2f %%/min" % (flight_id, rate))
+        print("all flights: %.2f %%/min" % overall)
+    elif args.cmd == 'yaw-overshoot':
+        for gains, stats in archive.yaw_overshoot(**filters).items():
+            print("gains %s: %d turns, mean %.1f deg, max %.1f deg" % (gains, stats['count'], stats['mean'], stats['max']))
+
+
+if __name__ == '__main__':
+    main()
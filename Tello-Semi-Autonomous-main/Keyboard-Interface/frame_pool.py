@@ -0,0 +1,109 @@
+from collections import deque
+from threading import Lock
+import time
+import numpy as np
+
+from instrumentation import metrics
+
+
+class Frame:
+    """
+    A reusable frame buffer, with its grayscale twin.
+    The gray image is converted at most once per frame and shared by every detector.
+    """
+
+    __slots__ = ('bgr', '_gray', 'gray_valid', 'number', 'stamp', 'pool')
+
+    def __init__(self, shape, pool):
+        self.bgr = np.empty(shape, dtype=np.uint8)
+        self._gray = np.empty(shape[:2], dtype=np.uint8)
+        self.gray_valid = False
+        self.number = 0
+        # capture time (time.time()), for measuring latency downstream
+        self.stamp = 0.0
+        self.pool = pool
+
+    def load(self, src, number, stamp=None):
+        """
+            Copy a decoded frame into this buffer.
+            @stamp : when the frame was captured, now by default.
+        """
+        np.copyto(self.bgr, src)
+        self.gray_valid = False
+        self.number = number
+        self.stamp = time.time() if stamp is None else stamp
+
+    def gray(self):
+        """
+            Returns the grayscale view of the frame, converting it on first use.
+        """
+        if not self.gray_valid:
+            import cv2
+            cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY, dst=self._gray)
+            self.gray_valid = True
+        return self._gray
+
+    def release(self):
+        """
+            Give the buffer back to its pool.
+        """
+        self.pool.release(self)
+
+
+class FramePool:
+
+    def __init__(self, count=7):
+        """
+            Initialize.
+            @count : the number of buffers. It should cover the frame queue,
+                     the frame being processed, the frame on display and the
+                     one being filled by the capture thread.
+        """
+        self.count = count
+        self.shape = None
+        self.free = deque()
+        self.lock = Lock()
+        # buffers created, including the first batch
+        self.allocations = 0
+        self.exhausted = 0
+
+    def _allocate(self, shape):
+        self.shape = shape
+        self.free.clear()
+        for _ in range(self.count):
+            self.free.append(Frame(shape, self))
+        self.allocations += self.count
+        metrics.count("pool.alloc", self.count)
+
+    def acquire(self, shape):
+        """
+            Returns a free Frame of the given shape, or None if all are in use.
+            Buffers are allocated on the first frame, and again only if the
+            stream resolution changes.
+        """
+        with self.lock:
+            if shape != self.shape:
+                self._allocate(shape)
+            if not self.free:
+                self.exhausted += 1
+                metrics.count("pool.exhausted")
+                return None
+            return self.free.popleft()
+
+    def release(self, frame):
+        with self.lock:
+            # frames from before a resolution change are simply dropped
+            if frame.bgr.shape == self.shape:
+                self.free.append(frame)
+
+    def stats(self):
+        """
+            Returns the buffer counts, for checking the steady state allocates nothing.
+        """
+        with self.lock:
+            return {
+                'buffers': self.count,
+                'free': len(self.free),
+                'allocations': self.allocations,
+                'exhausted': self.exhausted,
+            }
@@ -0,0 +1,177 @@
+from math import degrees, radians, tan
+from threading import Lock
+from time import perf_counter_ns
+import cv2
+import numpy as np
+
+from instrumentation import metrics
+
+
+class HoverStabilizer:
+    """
+    Holds the drone in place between marker sightings with sparse optical flow.
+
+    Features are tracked with pyramidal Lucas-Kanade on a downscaled copy of
+    the shared grayscale frame. The image drift accumulated since the hold
+    started is turned into a corrective rc command:
+        horizontal shift not explained by the yaw change -> left/right (a)
+        expansion / contraction of the tracks           -> forward/backward (b)
+        vertical shift                                  -> up/down (c)
+        yaw change since the hold started               -> yaw (d)
+    """
+
+    def __init__(self, scale=0.25, max_features=120, min_features=15, budget_ms=8.0,
+                 hfov=82.6, gains=(0.6, 150.0, 0.4, 1.5), max_command=25):
+        """
+            Initialize.
+            @scale : the downscale factor of the tracked image.
+            @max_features : the most features to track.
+            @min_features : below this the features are re-detected, and if
+                            that does not help the stabilizer stops correcting.
+            @budget_ms : per-frame compute budget. The feature count is adapted to stay within it.
+            @hfov : horizontal field of view of the camera (degrees).
+            @gains : (a per px, b per unit of scale, c per px, d per degree).
+            @max_command : clamp of every corrective rc term.
+        """
+        self.scale = scale
+        self.max_features = max_features
+        self.features = max_features
+        self.min_features = min_features
+        self.budget_ns = budget_ms * 1e6
+        self.hfov = hfov
+        self.gains = gains
+        self.max_command = max_command
+
+        self.small = None
+        self.prev = None
+        self.prev_pts = None
+        self.has_prev = False
+        self.focal = None
+        self.lk_params = dict(winSize=(15, 15), maxLevel=2,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+        self.tracking = False
+        self.command = (0, 0, 0, 0)
+        # reset() comes from the keyboard thread, update() runs on the video thread
+        self.lock = Lock()
+        # counts the holds, so a frame measured across a reset is not applied to the new hold
+        self.holds = 0
+        self._reset()
+
+    def reset(self, yaw=None):
+        """
+            Start a new hold at the current position (e.g. when the pilot lets go of the keys).
+            Safe to call from another thread than update().
+        """
+        with self.lock:
+            self._reset(yaw)
+
+    def _reset(self, yaw=None):
+        self.holds += 1
+        self.drift_x = 0.0
+        self.drift_y = 0.0
+        self.drift_scale = 0.0
+        self.hold_yaw = yaw
+        self.last_yaw = yaw
+        self.command = (0, 0, 0, 0)
+
+    def _seed(self):
+        pts = cv2.goodFeaturesToTrack(self.prev, maxCorners=self.features, qualityLevel=0.01,
+                                      minDistance=7, blockSize=7)
+        self.prev_pts = pts
+        metrics.count("hover.seed")
+
+    def update(self, frame, yaw=None):
+        """
+            Track one frame and refresh the corrective command.
+            @frame : a pooled Frame (its shared grayscale image is used).
+            @yaw : the drone yaw from the state (degrees), or None.
+            Returns the corrective (a, b, c, d).
+        """
+        start = perf_counter_ns()
+        hold = self.holds
+        gray = frame.gray()
+        h, w = int(gray.shape[0] * self.scale), int(gray.shape[1] * self.scale)
+        if self.small is None or self.small.shape != (h, w):
+            self.small = np.empty((h, w), dtype=np.uint8)
+            self.prev = np.empty((h, w), dtype=np.uint8)
+            self.prev_pts = None
+            self.focal = (w / 2) / tan(radians(self.hfov) / 2)
+            self.has_prev = False
+        cv2.resize(gray, (w, h), dst=self.small, interpolation=cv2.INTER_AREA)
+        if not self.has_prev:
+            # nothing to track against yet
+            self.prev, self.small = self.small, self.prev
+            self.has_prev = True
+            return self.command
+
+        if self.prev_pts is None or len(self.prev_pts) < self.min_features:
+            self._seed()
+
+        dx = dy = ds = 0.0
+        n = 0
+        if self.prev_pts is not None and len(self.prev_pts) > 0:
+            pts, status, _ = cv2.calcOpticalFlowPyrLK(self.prev, self.small, self.prev_pts, None, **self.lk_params)
+            good = status.ravel() == 1
+            old, new = self.prev_pts[good].reshape(-1, 2), pts[good].reshape(-1, 2)
+            n = len(new)
+            if n >= self.min_features:
+                d = new - old
+                # medians are robust to the few tracks that jump to the wrong corner
+                dx, dy = np.median(d[:, 0]), np.median(d[:, 1])
+                # expansion about the image centre, least squares over all tracks
+                r = old - (w / 2, h / 2)
+                rr = np.einsum('ij,ij->', r, r)
+                ds = np.einsum('ij,ij->', r, d - (dx, dy)) / rr if rr > 0 else 0.0
+            self.prev_pts = new.reshape(-1, 1, 2)
+
+        # the new frame becomes the reference, by swapping the two buffers
+        self.prev, self.small = self.small, self.prev
+
+        self.tracking = n >= self.min_features
+        metrics.count("hover.tracks", n)
+        with self.lock:
+            if not self.tracking:
+                # too few features (blank wall, motion blur): plain hover, start over when they return
+                self._reset(yaw)
+                self.prev_pts = None
+            elif hold == self.holds:
+                self._correct(dx, dy, ds, yaw)
+
+        # keep the per-frame cost within the budget by tracking fewer features
+        elapsed = perf_counter_ns() - start
+        metrics.record("hover", elapsed)
+        if elapsed > self.budget_ns:
+            self.features = max(self.min_features * 2, int(self.features * 0.8))
+        elif elapsed < self.budget_ns / 2:
+            self.features = min(self.max_features, self.features + 5)
+        return self.command
+
+    def _correct(self, dx, dy, ds, yaw):
+        ga, gb, gc, gd = self.gains
+        if yaw is not None:
+            if self.last_yaw is None:
+                self.hold_yaw = self.last_yaw = yaw
+            # yawing right slides the scene left by focal * angle, take that out of the shift
+            turn = (yaw - self.last_yaw + 180) % 360 - 180
+            dx += self.focal * radians(turn)
+            self.last_yaw = yaw
+
+        self.drift_x += dx
+        self.drift_y += dy
+        self.drift_scale += ds
+
+        if yaw is not None:
+            # the scene moving left means the drone slid right: move left
+            a = ga * self.drift_x
+            d = gd * ((self.hold_yaw - yaw + 180) % 360 - 180)
+        else:
+            # without the yaw the horizontal drift cannot be split, correct it all by turning
+            a = 0.0
+            d = gd * degrees(self.drift_x / self.focal)
+        # the scene expanding means the drone moved forward: move back
+        b = -gb * self.drift_scale
+        # the scene moving down means the drone climbed: descend
+        c = -gc * self.drift_y
+        m = self.max_command
+        self.command = tuple(int(max(-m, min(v, m))) for v in (a, b, c, d))
@@ -0,0 +1,248 @@
+import threading
+from time import perf_counter_ns, time
+
+# 4 buckets per power of two, enough for anything up to ~292 years in ns
+SUB_BITS = 2
+N_BUCKETS = 64 << SUB_BITS
+
+
+def _bucket(ns):
+    """
+        Map a duration (ns) to its log-scaled histogram bucket.
+    """
+    bl = ns.bit_length()
+    if bl <= SUB_BITS + 1:
+        return ns
+    return (bl - SUB_BITS) << SUB_BITS | (ns >> (bl - SUB_BITS - 1)) & ((1 << SUB_BITS) - 1)
+
+
+def _bucket_value(idx):
+    """
+        The lower bound (ns) of a histogram bucket.
+    """
+    if idx < 1 << (SUB_BITS + 1):
+        return idx
+    octave, sub = idx >> SUB_BITS, idx & ((1 << SUB_BITS) - 1)
+    return ((1 << SUB_BITS) | sub) << (octave - 1)
+
+
+class Histogram:
+    """
+    Latency histogram of one span on one thread.
+    Only its owning thread writes to it, so recording takes no lock.
+    """
+
+    __slots__ = ('counts', 'n', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * N_BUCKETS
+        self.n = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, ns):
+        self.counts[_bucket(ns)] += 1
+        self.n += 1
+        self.total += ns
+        if ns > self.max:
+            self.max = ns
+
+    def merge(self, other):
+        for i, c in enumerate(other.counts):
+            if c:
+                self.counts[i] += c
+        self.n += other.n
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+            Returns the p-th percentile (ns), accurate to the bucket width.
+        """
+        if self.n == 0:
+            return 0
+        rank = p / 100 * self.n
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if c and seen >= rank:
+                return _bucket_value(i)
+        return self.max
+
+
+class _Span:
+
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.record(self.name, perf_counter_ns() - self.start)
+        return False
+
+
+class Metrics:
+
+    def __init__(self, enabled=True):
+        """
+            Initialize.
+            @enabled : when False, spans and counters cost a single check.
+        """
+        self.enabled = enabled
+        self.local = threading.local()
+        # (thread name, span name, Histogram) of every thread, for reporting
+        self.histograms = []
+        # (thread name, counters dict) of every thread
+        self.counters = []
+        self.lock = threading.Lock()
+        self.started = time()
+        self.server = None
+
+    def _thread_state(self):
+        state = self.local.__dict__
+        if 'hist' not in state:
+            name = threading.current_thread().name
+            state['hist'] = {}
+            state['count'] = {}
+            state['name'] = name
+            with self.lock:
+                self.counters.append((name, state['count']))
+        return state
+
+    def record(self, name, ns):
+        """
+            Add one duration (ns) to the histogram of the given span.
+        """
+        if not self.enabled:
+            return
+        state = self._thread_state()
+        hist = state['hist'].get(name)
+        if hist is None:
+            hist = state['hist'][name] = Histogram()
+            # registration is the only locked path, once per thread and span
+            with self.lock:
+                self.histograms.append((state['name'], name, hist))
+        hist.record(ns)
+
+    def span(self, name):
+        """
+            Time a block:
+                with metrics.span("detect"):
+                    ...
+        """
+        return _Span(self, name)
+
+    def count(self, name, n=1):
+        """
+            Increment a named counter.
+        """
+        if not self.enabled:
+            return
+        counters = self._thread_state()['count']
+        counters[name] = counters.get(name, 0) + n
+
+    def snapshot(self):
+        """
+            Returns the histograms merged over all threads, and the summed counters.
+        """
+        with self.lock:
+            histograms = list(self.histograms)
+            counters = list(self.counters)
+        merged = {}
+        for _, name, hist in histograms:
+            merged.setdefault(name, Histogram()).merge(hist)
+        totals = {}
+        for _, counts in counters:
+            for name, n in list(counts.items()):
+                totals[name] = totals.get(name, 0) + n
+        return merged, totals
+
+    def report(self):
+        """
+            Returns a plain-text table of every span and counter.
+        """
+        merged, totals = self.snapshot()
+        elapsed = max(time() - self.started, 1e-9)
+        lines = ["# span count rate/s mean_ms p50_ms p95_ms p99_ms max_ms"]
+        for name in sorted(merged):
+            h = merged[name]
+            mean = h.total / h.n if h.n else 0
+            lines.append("%s %d %.1f %.3f %.3f %.3f %.3f %.3f" % (
+                name, h.n, h.n / elapsed, mean / 1e6,
+                h.percentile(50) / 1e6, h.percentile(95) / 1e6,
+                h.percentile(99) / 1e6, h.max / 1e6))
+        lines.append("# counter value rate/s")
+        for name in sorted(totals):
+            lines.append("%s %d %.1f" % (name, totals[name], totals[name] / elapsed))
+        return "\n".join(lines) + "\n"
+
+    def dump(self, filename: str):
+        """
+            Writes the report to a file.
+        """
+        with open(filename, 'w') as f:
+            f.write(self.report())
+
+    def serve(self, port=8765):
+        """
+            Serves the report as text on http://127.0.0.1:<port>/ from a daemon thread.
+        """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.report().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=self.server.serve_forever, name="metrics-http", daemon=True).start()
+        return self.server
+
+
+class StartupTimer:
+    """
+    Wall-clock breakdown of a script's startup phases.
+    Phases may be marked from several threads.
+    """
+
+    def __init__(self):
+        self.t0 = perf_counter_ns()
+        self.marks = []
+        self.lock = threading.Lock()
+
+    def mark(self, phase):
+        """
+            Record that a phase finished now.
+        """
+        with self.lock:
+            self.marks.append((phase, threading.current_thread().name, perf_counter_ns() - self.t0))
+
+    def report(self):
+        """
+            Returns one line per phase with its time since start (ms).
+        """
+        with self.lock:
+            marks = sorted(self.marks, key=lambda m: m[2])
+        lines = ["Startup:"]
+        for phase, thread, ns in marks:
+            lines.append("  %8.1f ms  %-24s [%s]" % (ns / 1e6, phase, thread))
+        return "\n".join(lines)
+
+
+# the process-wide instance every module records into
+metrics = Metrics()
@@ -1,18 +1,86 @@
-from numpy import imag
-from Aruco_detection import ArucoDetection
-from Tello_video import FileVideoStreamTello
-from socket import *
-from djitellopy import tello
 from threading import Thread
-import cv2
-from math import atan2, cos, sin, sqrt, pi
-import numpy as np
 import keyboard
+import os
+import time
+import traceback
 from logger import Logger
+from instrumentation import metrics, StartupTimer
+from state_receiver import StateReceiver, receiver_tello
 
 class MinimalSubscriber():
 
-    def __init__(self):
+    def __init__(self, startup=None):
+        """
+            Brings up the keyboard control path first, then warms up
+            the vision subsystems (OpenCV, Aruco, video decoder) in the background.
+            @startup : a StartupTimer to record the phases into.
+        """
+        self.startup = startup or StartupTimer()
+
+        # start the keyboard thread
+        self.log = Logger("log1.csv")
+        self.command = "stand"
+        self.frame_counter = 0
+        self.keyboard_thread = Thread(target=self.keyboard_control, name="keyboard")
+        
+        self.log_thread = Thread(target=self.log_update, name="log", daemon=True)
+        self.save_thread = None
+
+        # set by start_vision()
+        self.map = None
+        self.odom = None
+        self.relay = None
+        self.hover = None
+        self.img = None
+        self.ids, self.corners = [], []
+        # raw copy of a frame for the log dumps: video() fills it when dump_wanted is set,
+        # log_update owns it from then until its imwrite returns
+        self.dump = None
+        self.dump_number = 0
+        self.dump_wanted = True
+        # video stages that raised, their traceback is printed once
+        self.failed_stages = set()
+
+        # connect to the Drone, its state packets are parsed into the receiver's ring
+        self.rx = StateReceiver().start()
+        self.me = receiver_tello(self.rx)
+        self.me.connect()   
+        self.startup.mark("connect")
+
+        # prints the Battery percentage
+        battery = self.me.get_battery()
+        print("Battery percentage:", battery)
+        
+        # if the battery is too low its arise an error
+        if battery < 10:
+            raise RuntimeError("Tello rejected attemp to takeoff due to low Battery")
+
+        # live metrics on http://127.0.0.1:8765/, a debug page must not keep the drone from flying
+        try:
+            metrics.serve()
+        except OSError as e:
+            print("Metrics page not started:", e)
+
+        self.keyboard_thread.start()
+        self.startup.mark("keyboard control ready")
+        self.log_thread.start()
+
+        self.vision_thread = Thread(target=self.start_vision, name="vision-warmup", daemon=True)
+        self.vision_thread.start()
+
+    def start_vision(self):
+        """
+            Import and build everything the video path needs, then start it.
+        """
+        import cv2
+        from marker_detector import MarkerDetector
+        from frame_pool import FramePool
+        from relay import FrameRelay
+        from hover_stabilizer import HoverStabilizer
+        from Tello_video import FileVideoStreamTello
+        from marker_map import LandmarkMap
+        from odometry import VelocityOdometry
+        self.startup.mark("vision imports")
 
         self.ARUCO_DICT = {
             "DICT_4X4_50": cv2.aruco.DICT_4X4_50,
@@ -38,42 +106,38 @@ class MinimalSubscriber():
             "DICT_APRILTAG_36h11": cv2.aruco.DICT_APRILTAG_36h11
         }
 
-        # start the keyboard thread
-        self.log = Logger("log1.csv")
-        self.command = "stand"
-        self.frame_counter = 0
-        self.keyboard_thread = Thread(target=self.keyboard_control)
-        
-        self.log_thread = Thread(target=self.log_update)
-
-        # connect to the Drone
-        self.me = tello.Tello()
-        self.me.connect()   
-
-        self.img = None
-
-        # prints the Battery percentage
-        print("Battery percentage:", self.me.get_battery())
-        
-        # create the video capture thread
-        self.video_thread = Thread(target=self.video)
-        # if the battery is too low its arise an error
-        if self.me.get_battery() < 10:
-            raise RuntimeError("Tello rejected attemp to takeoff due to low Battery")
+        # position estimate from the state stream, fed by log_update
+        self.odom = VelocityOdometry()
 
         # Aruco detector
-        self.aruco = ArucoDetection(self.ARUCO_DICT)
-        # stream thread
-        self.streamQ = FileVideoStreamTello(self.me)
-        self.draw_thread = Thread(target=self.draw)
+        self.aruco = MarkerDetector(self.ARUCO_DICT["DICT_4X4_100"])
+        # map of the detected Aruco landmarks
+        self.map = LandmarkMap()
+        # optical flow position hold while no key is pressed
+        self.hover = HoverStabilizer()
+        self.startup.mark("detector ready")
 
-
-        self.keyboard_thread.start()
-        # self.log_thread.start()
+        # stream thread
+        # reusable frame buffers: the queue, the frame in work, the one on display and the one being filled
+        self.pool = FramePool(count=4 + 3)
+        self.streamQ = FileVideoStreamTello(self.me, queuesize=4, pool=self.pool)
         self.streamQ.start()
+        # other viewers connect here instead of to the drone (python relay.py view)
+        try:
+            self.relay = FrameRelay(port=8766).start()
+        except OSError as e:
+            print("Video relay not started:", e)
+        # wait for the decoder to hand out its first frame
+        while not self.streamQ.more():
+            time.sleep(0.01)
+        self.startup.mark("first frame decoded")
+
+        # create the video capture thread
+        self.video_thread = Thread(target=self.video, name="video")
+        self.draw_thread = Thread(target=self.draw, name="draw")
         self.video_thread.start()
         # self.draw_thread.start()
-        
+        print(self.startup.report())
 
     def keyboard_control(self):
         """
@@ -93,10 +157,13 @@ class MinimalSubscriber():
         big_factor = 100
         medium_factor = 50
         tookoff = False
+        holding = False
+        m_held = False
 
         while True:
             a, b, c, d = 0, 0, 0, 0
             self.command = "stand"
+            m_pressed = False
 
             # Takeoff 
             if keyboard.is_pressed('space') and not tookoff:
@@ -153,50 +220,138 @@ class MinimalSubscriber():
                 a = 0.5 * big_factor
                 self.command = "YAW RIGHT"
             
-            # Save log
+            # Save log, once per press and off this thread: the rc commands must not wait for the disk
             elif keyboard.is_pressed('m'):
-                self.log.save_log()
-                print("Log saved successfully!")
+                m_pressed = True
+                if not m_held:
+                    if self.save_thread is not None and self.save_thread.is_alive():
+                        print("Still saving the last log")
+                    else:
+                        self.save_thread = Thread(target=self.save, name="save")
+                        self.save_thread.start()
+            m_held = m_pressed
             
+            # nothing held while flying: let the optical flow hold the position
+            if self.command == "stand" and tookoff and self.hover is not None:
+                if not holding:
+                    self.hover.reset(self.me.get_yaw())
+                    holding = True
+                if self.hover.tracking:
+                    a, b, c, d = self.hover.command
+            else:
+                holding = False
+
             # send the commands to the drone
-            self.me.send_rc_control(int(a), int(b), int(c), int(d))
+            with metrics.span("rc"):
+                self.me.send_rc_control(int(a), int(b), int(c), int(d))
+
 
+    def save(self):
+        """
+            Save the log (archived as well), the landmark map and the metrics.
+        """
+        self.log.save_log()
+        if self.map is not None:
+            self.map.save("map1.csv")
+        metrics.dump("metrics1.txt")
+        if self.relay is not None:
+            print("Relay viewers:", self.relay.stats())
+        print("Log saved successfully!")
 
     def log_update(self):
         """
-            Update the state of the drone into the log file.
+            Update the state of the drone into the log file and the odometry.
         """
+        import cv2
+        os.makedirs("frames", exist_ok=True)
+        seq = 0
         while True:
-            state: dict = self.me.get_current_state()
-            if len(state) == 21:
-                self.log.add(state, self.command, self.frame_counter)
-                cv2.imwrite("frames/frame_"+str(self.frame_counter)+".jpg", self.img)
-            
-
+            # every record received since the last pass, as a view into the ring
+            records, seq = self.rx.since(seq)
+            if len(records):
+                for record in records:
+                    self.log.add(record, self.command, self.frame_counter)
+                if self.odom is not None:
+                    with metrics.span("odometry"):
+                        self.odom.add_records(records)
+                if not self.dump_wanted:
+                    with metrics.span("frame.write"):
+                        cv2.imwrite("frames/frame_"+str(self.dump_number)+".jpg", self.dump)
+                    self.dump_wanted = True
+            time.sleep(0.005)
 
     def video(self):
         """
             This method detects Faces/Persons and Aruco Codes.
             It plot the video captured from the Drone and it's detected objects boundaries.
         """
+        import cv2
+        import numpy as np
 
+        shown = None
         while True:
             try:
-                img = self.streamQ.read()
-                # wait for valid frame
-                imghud = img.copy()
-                self.aruco.set_image_to_process(img)
-                self.ids, self.corners = self.aruco.draw_detection(img)
-                self.frame_counter += 1
-                self.img = imghud
-                
+                with metrics.span("frame.wait"):
+                    frame = self.streamQ.read()
             except Exception:
                 break
-            
-            cv2.imshow("ArucoView",self.img)
-            k = cv2.waitKey(1)
+
+            # the overlay is drawn into the frame itself, the dumps must stay clean for reprocess.py
+            if self.dump_wanted:
+                if self.dump is None or self.dump.shape != frame.bgr.shape:
+                    self.dump = np.empty_like(frame.bgr)
+                np.copyto(self.dump, frame.bgr)
+                self.dump_number = self.frame_counter
+                self.dump_wanted = False
+
+            # a failing stage skips its work for this frame only, the others keep running
+            state = self.rx.latest()
+            try:
+                with metrics.span("detect"):
+                    self.ids, self.corners = self.aruco.detect(frame)
+                with metrics.span("map"):
+                    self.odom.correct_from_markers(self.map, self.ids, self.corners, state)
+                    x, y, _ = self.odom.position()
+                    self.map.observe(self.ids, self.corners, state, pose=(x, y), stamp=self.frame_counter)
+            except Exception:
+                self.stage_failed("map")
+            try:
+                self.hover.update(frame, None if state is None else int(state['yaw']))
+            except Exception:
+                self.stage_failed("hover")
+            try:
+                # the overlay goes straight onto the pooled buffer, no copy
+                with metrics.span("overlay"):
+                    self.aruco.draw(frame.bgr, self.ids, self.corners)
+                if self.relay is not None:
+                    self.relay.publish(frame.bgr, frame.number, frame.stamp)
+            except Exception:
+                self.stage_failed("overlay")
+            self.frame_counter += 1
+            metrics.count("video.frames")
+            self.img = frame.bgr
+
+            with metrics.span("display"):
+                cv2.imshow("ArucoView",self.img)
+                k = cv2.waitKey(1)
+
+            # keep the frame on display (log_update may still save it), hand back the one before
+            if shown is not None:
+                shown.release()
+            shown = frame
+
+    def stage_failed(self, stage):
+        """
+            Report an error of a video stage: the traceback the first time, a count after that.
+        """
+        if stage not in self.failed_stages:
+            self.failed_stages.add(stage)
+            print("Video stage '%s' failed:" % stage)
+            traceback.print_exc()
+        metrics.count("video.error." + stage)
 
     def draw(self):
+        import cv2
         while True:
             if self.img is not None:
                 h,w = self.img.shape[:2]
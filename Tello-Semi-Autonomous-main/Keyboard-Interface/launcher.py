@@ -0,0 +1,53 @@
+"""
+Single entry point for the flight scripts.
+Only the modules of the chosen mode are imported, and the startup is timed.
+
+    sudo python3 launcher.py keyboard
+    sudo python3 launcher.py pid | yaw60 | voice
+"""
+import argparse
+import importlib.util
+import os
+
+from instrumentation import StartupTimer
+
+# mode -> script file (some of them are not importable by name)
+MODES = {
+    'keyboard': 'keyboardControl.py',
+    'pid': 'RemoteControl+PID.py',
+    'yaw60': 'remoteControlYAW60.py',
+    'voice': 'VoiceControllOffline.py',
+}
+
+
+def load(mode):
+    """
+        Import the script of the given mode without running its __main__ block.
+    """
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), MODES[mode])
+    spec = importlib.util.spec_from_file_location(mode + "_mode", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    startup = StartupTimer()
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('mode', choices=sorted(MODES), nargs='?', default='keyboard')
+    args = parser.parse_args()
+
+    module = load(args.mode)
+    startup.mark("import " + MODES[args.mode])
+
+    if args.mode == 'keyboard':
+        # returns as soon as the keyboard is live, vision keeps warming up
+        module.MinimalSubscriber(startup)
+        print(startup.report())
+    else:
+        # these scripts fly (or block) inside their constructor, they print the report before that
+        module.MinimalSubscriber(startup)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,66 @@
-import pandas as pd
-import djitellopy
 import time
+from threading import Lock
+from instrumentation import metrics
 
 class Logger:
 
-    def __init__(self, filename: str):
-        
+    def __init__(self, filename: str, gains=None, archive='archive'):
+        """
+            Initialize.
+            @filename : the csv the log is saved to.
+            @gains : the controller gains of the flight (e.g. {'kp': 0.8}), kept in the archive.
+            @archive : the FlightArchive directory every saved log is added to, None to skip.
+        """
         self.filename = filename
-        self.df = pd.DataFrame(columns=['time','frame#' ,'command', 'pitch', 'roll', 'Yaw', 'height', 'Vx', 'Vy', 'Vz', 'battery'])
+        self.gains = gains
+        self.archive = archive
+        # built on first use, so pandas is not imported at startup
+        self._df = None
+        # add() and save_log() run on different threads
+        self.lock = Lock()
+
+    @property
+    def df(self):
+        if self._df is None:
+            import pandas as pd
+            self._df = pd.DataFrame(columns=['time','frame#' ,'command', 'pitch', 'roll', 'Yaw', 'height', 'Vx', 'Vy', 'Vz', 'battery'])
+        return self._df
 
 
     def add(self, data: dict, command: str, frame_num):
         """
             Given a list of all parametrs, add them to the DF.
         """
-        curr_time = time.time()
-        roll = data['roll']
-        pitch = data['pitch']
-        yaw = data['yaw']
-        height = data['h']
-        vx = data['vgx']
-        vy = data['vgy']
-        vz = data['vgz']
-        battery = data['bat']
-        row = [curr_time, frame_num, command, pitch, roll, yaw, height, vx, vy, vz, battery]
-        print(row)
-        self.df.loc[len(self.df)] = row
+        with metrics.span("log.add"):
+            curr_time = time.time()
+            roll = data['roll']
+            pitch = data['pitch']
+            yaw = data['yaw']
+            height = data['h']
+            vx = data['vgx']
+            vy = data['vgy']
+            vz = data['vgz']
+            battery = data['bat']
+            row = [curr_time, frame_num, command, pitch, roll, yaw, height, vx, vy, vz, battery]
+            print(row)
+            with self.lock:
+                self.df.loc[len(self.df)] = row
     
     def save_log(self):
         """
-            This method saves the data frame to a csv file
+            This method saves the data frame to a csv file,
+            the level-of-detail pyramids of telemetry_viewer next to it,
+            and adds the flight to the archive (log1.csv is overwritten every run).
+            It takes a while, call it off the control loop.
         """
-        self.df.to_csv(self.filename)
+        with self.lock:
+            df = self.df.copy()
+        df.to_csv(self.filename)
+        if len(df):
+            from telemetry_viewer import build_pyramid
+            build_pyramid(df, self.filename)
+            if self.archive is not None:
+                from flight_archive import FlightArchive
+                FlightArchive(self.archive).ingest_frame(df, self.filename, gains=self.gains)
 
 
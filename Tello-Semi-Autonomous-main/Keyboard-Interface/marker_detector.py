@@ -0,0 +1,46 @@
+import cv2
+
+from instrumentation import metrics
+
+
+class MarkerDetector:
+    """
+    Aruco detection on the shared grayscale image of a pooled Frame,
+    with the overlay drawn in place on the frame's own buffer.
+    """
+
+    def __init__(self, aruco_dict=cv2.aruco.DICT_4X4_100, **parameters):
+        """
+            Initialize.
+            @aruco_dict : one of the cv2.aruco dictionary ids (see ARUCO_DICT).
+            @parameters : overrides of cv2.aruco.DetectorParameters fields,
+                          e.g. adaptiveThreshWinSizeMax=33.
+        """
+        self.dictionary = cv2.aruco.Dictionary_get(aruco_dict)
+        self.parameters = cv2.aruco.DetectorParameters_create()
+        for name, value in parameters.items():
+            setattr(self.parameters, name, value)
+
+    def detect(self, frame):
+        """
+            Returns the (ids, corners) of the markers in the frame,
+            in the same layout as ArucoDetection.draw_detection.
+        """
+        return self.detect_gray(frame.gray())
+
+    def detect_gray(self, gray):
+        """
+            Same as detect, on a grayscale image.
+        """
+        corners, ids, _ = cv2.aruco.detectMarkers(gray, self.dictionary, parameters=self.parameters)
+        if ids is None:
+            return [], []
+        metrics.count("detect.markers", len(ids))
+        return ids, corners
+
+    def draw(self, img, ids, corners):
+        """
+            Draw the detections onto img in place.
+        """
+        if len(ids):
+            cv2.aruco.drawDetectedMarkers(img, corners, ids)
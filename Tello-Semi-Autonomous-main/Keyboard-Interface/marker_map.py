@@ -0,0 +1,219 @@
+from math import atan2, cos, sin, sqrt, radians, degrees, tan, floor
+from threading import Lock
+
+
+class Landmark:
+    """
+    A single Aruco marker in the map.
+    The position is a running mean over all of its observations.
+    """
+
+    __slots__ = ('id', 'x', 'y', 'z', 'count', 'last_seen', 'cell')
+
+    def __init__(self, marker_id, x, y, z, stamp, cell):
+        self.id = marker_id
+        self.x = x
+        self.y = y
+        self.z = z
+        self.count = 1
+        self.last_seen = stamp
+        self.cell = cell
+
+    def update(self, x, y, z, stamp, max_weight):
+        """
+            Fold a new observation into the running mean.
+            @max_weight : caps the number of observations that are averaged,
+                          so a marker that was moved is still re-learned.
+        """
+        self.count = min(self.count + 1, max_weight)
+        w = 1.0 / self.count
+        self.x += (x - self.x) * w
+        self.y += (y - self.y) * w
+        self.z += (z - self.z) * w
+        self.last_seen = stamp
+
+
+class LandmarkMap:
+
+    def __init__(self, marker_size=15.0, frame_width=960, hfov=82.6,
+                 cell_size=100.0, max_weight=50):
+        """
+            Initialize.
+            @marker_size : the printed marker side length (cm).
+            @frame_width : width of the frames the detections come from (px).
+            @hfov : horizontal field of view of the Tello camera (degrees).
+            @cell_size : the side length of a spatial index cell (cm).
+            @max_weight : the maximal number of observations averaged per marker.
+        """
+        self.marker_size = marker_size
+        self.frame_width = frame_width
+        self.focal = (frame_width / 2) / tan(radians(hfov) / 2)
+        self.cell_size = cell_size
+        self.max_weight = max_weight
+
+        # marker id -> Landmark
+        self.landmarks = {}
+        # (cell x, cell y) -> set of marker ids
+        self.grid = {}
+        # bounding box of the occupied cells, bounds the nearest() search
+        self.bounds = None
+        self.lock = Lock()
+
+    def _cell(self, x, y):
+        return (floor(x / self.cell_size), floor(y / self.cell_size))
+
+    def _file(self, marker_id, cell):
+        self.grid.setdefault(cell, set()).add(marker_id)
+        if self.bounds is None:
+            self.bounds = [cell[0], cell[1], cell[0], cell[1]]
+        else:
+            b = self.bounds
+            b[0], b[1] = min(b[0], cell[0]), min(b[1], cell[1])
+            b[2], b[3] = max(b[2], cell[0]), max(b[3], cell[1])
+
+    def _move(self, landmark, cell):
+        """
+            Re-file a landmark in the grid if its estimate crossed a cell border.
+        """
+        if landmark.cell == cell:
+            return
+        ids = self.grid.get(landmark.cell)
+        if ids is not None:
+            ids.discard(landmark.id)
+            if not ids:
+                del self.grid[landmark.cell]
+        self._file(landmark.id, cell)
+        landmark.cell = cell
+
+    def project(self, corners, state: dict, pose=(0.0, 0.0)):
+        """
+            Convert a marker's image corners into a world position (cm).
+            @corners : the 4x2 corners of the marker as returned by cv2.aruco.
+            @state : the Tello state, a dict or a StateReceiver record (yaw in degrees, h in cm).
+            @pose : the (x, y) position of the drone in the world (cm).
+        """
+        pts = [(float(p[0]), float(p[1])) for p in corners]
+        cx = sum(p[0] for p in pts) / 4
+        # mean side length in pixels
+        side = sum(sqrt((pts[i][0] - pts[i - 1][0]) ** 2 + (pts[i][1] - pts[i - 1][1]) ** 2)
+                   for i in range(4)) / 4
+        if side <= 0:
+            return None
+
+        dist = self.focal * self.marker_size / side
+        bearing = atan2(cx - self.frame_width / 2, self.focal)
+        heading = radians(state['yaw']) + bearing
+
+        x = pose[0] + dist * cos(heading)
+        y = pose[1] + dist * sin(heading)
+        z = float(state['h'])
+        return x, y, z
+
+    def observe(self, ids, corners, state: dict, pose=(0.0, 0.0), stamp=0.0):
+        """
+            Fuse one frame of detections into the map.
+            @ids, @corners : the output of ArucoDetection.draw_detection.
+            @state : the Tello state dict at the time of the frame.
+            @pose : the (x, y) position of the drone (cm), e.g. from odometry.
+            Returns the ids that were updated.
+        """
+        if ids is None or len(ids) == 0:
+            return []
+
+        updated = []
+        with self.lock:
+            for marker_id, coord in zip(ids, corners):
+                marker_id = int(marker_id[0]) if hasattr(marker_id, '__len__') else int(marker_id)
+                pos = self.project(coord.reshape((4, 2)), state, pose)
+                if pos is None:
+                    continue
+                x, y, z = pos
+                cell = self._cell(x, y)
+
+                landmark = self.landmarks.get(marker_id)
+                if landmark is None:
+                    landmark = Landmark(marker_id, x, y, z, stamp, cell)
+                    self.landmarks[marker_id] = landmark
+                    self._file(marker_id, cell)
+                else:
+                    landmark.update(x, y, z, stamp, self.max_weight)
+                    self._move(landmark, self._cell(landmark.x, landmark.y))
+                updated.append(marker_id)
+        return updated
+
+    def get(self, marker_id):
+        """
+            Returns the landmark of the given id, or None if it was never seen.
+        """
+        return self.landmarks.get(marker_id)
+
+    def nearest(self, x, y, k=1):
+        """
+            Returns the k landmarks closest to (x, y), closest first.
+            Searches the grid ring by ring, so only nearby cells are visited.
+        """
+        with self.lock:
+            if not self.landmarks:
+                return []
+            k = min(k, len(self.landmarks))
+            cx, cy = self._cell(x, y)
+            found = []
+            ring = 0
+            b = self.bounds
+            # no occupied cell lies further than this many rings away
+            limit = max(cx - b[0], cy - b[1], b[2] - cx, b[3] - cy)
+            while True:
+                for ix in range(cx - ring, cx + ring + 1):
+                    for iy in range(cy - ring, cy + ring + 1):
+                        # only the border of the current ring is new
+                        if max(abs(ix - cx), abs(iy - cy)) != ring:
+                            continue
+                        for marker_id in self.grid.get((ix, iy), ()):
+                            lm = self.landmarks[marker_id]
+                            found.append(((lm.x - x) ** 2 + (lm.y - y) ** 2, lm))
+                # every unvisited cell is at least `ring` cells away
+                if len(found) >= k:
+                    found.sort(key=lambda f: f[0])
+                    if found[k - 1][0] <= (ring * self.cell_size) ** 2:
+                        return [lm for _, lm in found[:k]]
+                ring += 1
+                if ring > limit:
+                    found.sort(key=lambda f: f[0])
+                    return [lm for _, lm in found[:k]]
+
+    def visible(self, x, y, yaw, hfov=82.6, max_range=500.0):
+        """
+            Returns the landmarks that should be in view of a drone at (x, y)
+            looking towards yaw (degrees), sorted by distance.
+        """
+        half = hfov / 2
+        r2 = max_range ** 2
+        x0, y0 = self._cell(x - max_range, y - max_range)
+        x1, y1 = self._cell(x + max_range, y + max_range)
+        result = []
+        with self.lock:
+            for ix in range(x0, x1 + 1):
+                for iy in range(y0, y1 + 1):
+                    for marker_id in self.grid.get((ix, iy), ()):
+                        lm = self.landmarks[marker_id]
+                        dx, dy = lm.x - x, lm.y - y
+                        d2 = dx * dx + dy * dy
+                        if d2 > r2:
+                            continue
+                        off = (degrees(atan2(dy, dx)) - yaw + 180) % 360 - 180
+                        if abs(off) <= half:
+                            result.append((d2, lm))
+        result.sort(key=lambda r: r[0])
+        return [lm for _, lm in result]
+
+    def __len__(self):
+        return len(self.landmarks)
+
+    def save(self, filename: str):
+        """
+            Saves the map to a csv file.
+        """
+        with self.lock, open(filename, 'w') as f:
+            f.write("id,x,y,z,count,last_seen\n")
+            for lm in sorted(self.landmarks.values(), key=lambda l: l.id):
+                f.write(f"{lm.id},{lm.x:.2f},{lm.y:.2f},{lm.z:.2f},{lm.count},{lm.last_seen}\n")
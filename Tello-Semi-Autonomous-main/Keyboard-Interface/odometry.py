@@ -0,0 +1,183 @@
+import time
+from threading import Lock
+import numpy as np
+
+
+def integrate(t, vgx, vgy, yaw, x0=0.0, y0=0.0, t0=None, velocity_scale=10.0, body_frame=True):
+    """
+        Integrate a run of Tello velocity samples into positions (cm).
+        All the samples are integrated at once, so this runs over a whole
+        recorded log as fast as over a live buffer.
+        @t : sample times (seconds).
+        @vgx, @vgy : the Tello speeds (dm/s).
+        @yaw : the Tello yaw (degrees), used when body_frame is set.
+        @x0, @y0, @t0 : the position and time before the first sample.
+        @velocity_scale : converts the Tello speed unit to cm/s.
+        @body_frame : True if vgx/vgy are forward/right of the drone.
+        Returns the x and y arrays of the track.
+    """
+    t = np.asarray(t, dtype=np.float64)
+    vx = np.asarray(vgx, dtype=np.float64) * velocity_scale
+    vy = np.asarray(vgy, dtype=np.float64) * velocity_scale
+
+    if body_frame:
+        psi = np.radians(np.asarray(yaw, dtype=np.float64))
+        c, s = np.cos(psi), np.sin(psi)
+        vx, vy = vx * c - vy * s, vx * s + vy * c
+
+    dt = np.diff(t, prepend=t[0] if t0 is None else t0)
+    # drop gaps (reconnects, paused logs) instead of integrating across them
+    dt[(dt < 0) | (dt > 1.0)] = 0.0
+
+    x = x0 + np.cumsum(vx * dt)
+    y = y0 + np.cumsum(vy * dt)
+    return x, y
+
+
+class VelocityOdometry:
+
+    def __init__(self, buffer_size=64, velocity_scale=10.0, body_frame=True, correction_gain=0.5, max_chunks=32):
+        """
+            Initialize.
+            @buffer_size : number of state packets integrated together.
+            @max_chunks : the history is merged into one array past this many chunks.
+            @velocity_scale : converts the Tello speed unit to cm/s.
+            @body_frame : True if vgx/vgy are forward/right of the drone.
+            @correction_gain : how much of a marker fix is applied (0..1).
+        """
+        self.velocity_scale = velocity_scale
+        self.body_frame = body_frame
+        self.correction_gain = correction_gain
+        self.lock = Lock()
+
+        # pending packets: time, vgx, vgy, yaw, h
+        self.buf = np.zeros((5, buffer_size), dtype=np.float64)
+        self.n = 0
+
+        self.x = 0.0
+        self.y = 0.0
+        self.z = 0.0
+        self.t = None
+
+        # integrated history, one (t, x, y, z) chunk per flush
+        self.chunks = []
+        self.max_chunks = max_chunks
+
+    def add(self, state: dict, stamp=None):
+        """
+            Buffer one state packet. The buffer is integrated when full.
+        """
+        stamp = time.time() if stamp is None else stamp
+        with self.lock:
+            self.buf[:, self.n] = (stamp, state['vgx'], state['vgy'], state['yaw'], state['h'])
+            self.n += 1
+            if self.n == self.buf.shape[1]:
+                self._flush()
+
+    def add_records(self, records):
+        """
+            Buffer a block of StateReceiver records (e.g. a history() view).
+            Full buffers are integrated as they fill up.
+        """
+        with self.lock:
+            size = self.buf.shape[1]
+            i = 0
+            while i < len(records):
+                block = records[i:i + size - self.n]
+                k = len(block)
+                end = self.n + k
+                self.buf[0, self.n:end] = block['recv_time']
+                self.buf[1, self.n:end] = block['vgx']
+                self.buf[2, self.n:end] = block['vgy']
+                self.buf[3, self.n:end] = block['yaw']
+                self.buf[4, self.n:end] = block['h']
+                self.n = end
+                i += k
+                if self.n == size:
+                    self._flush()
+
+    def _flush(self):
+        if self.n == 0:
+            return
+        t, vgx, vgy, yaw, h = self.buf[:, :self.n]
+        x, y = integrate(t, vgx, vgy, yaw, self.x, self.y, self.t,
+                         self.velocity_scale, self.body_frame)
+        self.chunks.append(np.stack((t, x, y, h)))
+        if len(self.chunks) > self.max_chunks:
+            self.chunks = [np.concatenate(self.chunks, axis=1)]
+        self.x, self.y, self.z, self.t = x[-1], y[-1], h[-1], t[-1]
+        self.n = 0
+
+    def _estimate(self):
+        # the integrated position moved on by the pending packets, without committing them
+        if self.n == 0:
+            return self.x, self.y, self.z
+        t, vgx, vgy, yaw, h = self.buf[:, :self.n]
+        x, y = integrate(t, vgx, vgy, yaw, self.x, self.y, self.t,
+                         self.velocity_scale, self.body_frame)
+        return x[-1], y[-1], h[-1]
+
+    def position(self):
+        """
+            Returns the current (x, y, z) estimate (cm).
+            Cheap enough for every video frame: the buffer is not flushed.
+        """
+        with self.lock:
+            return self._estimate()
+
+    def correct(self, x, y):
+        """
+            Pull the estimate towards an absolute fix (e.g. from a known marker).
+        """
+        with self.lock:
+            ex, ey, _ = self._estimate()
+            # shifting the base moves the pending packets along with it
+            self.x += (x - ex) * self.correction_gain
+            self.y += (y - ey) * self.correction_gain
+
+    def correct_from_markers(self, landmarks, ids, corners, state: dict):
+        """
+            Correct the drift with every detected marker that is already in the map.
+            @landmarks : a LandmarkMap with the known marker positions.
+            @ids, @corners : the output of ArucoDetection.draw_detection.
+            Returns the number of markers used.
+        """
+        if ids is None or len(ids) == 0:
+            return 0
+        fixes = []
+        for marker_id, coord in zip(ids, corners):
+            lm = landmarks.get(int(np.ravel(marker_id)[0]))
+            # a marker seen for the first time only places itself relative to us
+            if lm is None or lm.count < 2:
+                continue
+            rel = landmarks.project(coord.reshape((4, 2)), state)
+            if rel is not None:
+                fixes.append((lm.x - rel[0], lm.y - rel[1]))
+        if fixes:
+            fx, fy = np.mean(fixes, axis=0)
+            self.correct(fx, fy)
+        return len(fixes)
+
+    def track(self):
+        """
+            Returns the (t, x, y, z) history as a 4xN array.
+        """
+        with self.lock:
+            self._flush()
+            if not self.chunks:
+                return np.zeros((4, 0))
+            if len(self.chunks) > 1:
+                self.chunks = [np.concatenate(self.chunks, axis=1)]
+            return self.chunks[0]
+
+
+def track_from_log(filename: str, velocity_scale=10.0, body_frame=True):
+    """
+        Integrate a csv saved by Logger into a (t, x, y, z) track.
+    """
+    import pandas as pd
+    df = pd.read_csv(filename, usecols=['time', 'Yaw', 'height', 'Vx', 'Vy'])
+    t = df['time'].to_numpy()
+    x, y = integrate(t, df['Vx'].to_numpy(), df['Vy'].to_numpy(), df['Yaw'].to_numpy(),
+                     velocity_scale=velocity_scale, body_frame=body_frame)
+    return np.stack((t, x, y, df['height'].to_numpy(dtype=np.float64)))
@@ -0,0 +1,266 @@
+"""
+Ground-station relay: encode each video frame once, serve it to many local viewers.
+
+Every message on the TCP stream is a 16 byte header followed by the JPEG:
+    uint32 jpeg length, uint32 frame number, float64 capture time (time.time()).
+Each client gets its own sender thread and a single-frame slot; a slow
+client just has its older frames overwritten, it never blocks the video loop.
+
+    python relay.py view --host 127.0.0.1 --port 8766
+"""
+import argparse
+import socket
+import struct
+import time
+from threading import Condition, Lock, Thread
+
+import numpy as np
+
+from instrumentation import metrics
+
+HEADER = struct.Struct('!IId')
+
+
+class _Client:
+
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.cond = Condition()
+        self.pending = None
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        # seconds from capture to the frame being sent to the viewer
+        self.lag = 0.0
+        self.max_lag = 0.0
+
+    def offer(self, packet):
+        with self.cond:
+            if self.pending is not None:
+                self.dropped += 1
+            self.pending = packet
+            self.cond.notify()
+
+    def run(self):
+        try:
+            while True:
+                with self.cond:
+                    while self.pending is None and not self.closed:
+                        self.cond.wait()
+                    if self.closed:
+                        return
+                    number, stamp, data = self.pending
+                    self.pending = None
+                self.sock.sendall(HEADER.pack(len(data), number, stamp))
+                self.sock.sendall(data)
+                self.sent += 1
+                self.lag = time.time() - stamp
+                self.max_lag = max(self.max_lag, self.lag)
+        except OSError:
+            pass
+        finally:
+            self.closed = True
+            self.sock.close()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+
+class FrameRelay:
+
+    def __init__(self, host='127.0.0.1', port=8766, width=480, quality=70):
+        """
+            Initialize.
+            @host, @port : where the viewers connect.
+            @width : the width of the relayed frames (px), None keeps the stream size.
+            @quality : JPEG quality (0-100).
+        """
+        self.addr = (host, port)
+        self.width = width
+        self.quality = quality
+
+        # the latest frame from the video loop, copied into a reused buffer,
+        # and the buffer the encoder is working on
+        self.staging = None
+        self.work = None
+        self.scaled = None
+        self.stamp = 0.0
+        self.number = -1
+        self.encoded = -1
+        self.cond = Condition()
+
+        self.clients = []
+        self.clients_lock = Lock()
+        self.server = None
+        self.stopped = False
+
+    def start(self):
+        """
+            Start the accepting and the encoding threads.
+        """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind(self.addr)
+        self.server.listen()
+        # the actual port, in case 0 was asked for
+        self.addr = self.server.getsockname()
+        Thread(target=self.accept, name="relay-accept", daemon=True).start()
+        Thread(target=self.encode, name="relay-encode", daemon=True).start()
+        return self
+
+    def publish(self, img, number, stamp=None):
+        """
+            Hand a frame to the relay. This only copies the frame and returns,
+            the encoding happens on the relay's own thread. Without viewers it does nothing.
+        """
+        with self.clients_lock:
+            if not self.clients:
+                # nobody is watching, spare the video loop the copy
+                return
+        with metrics.span("relay.publish"):
+            with self.cond:
+                if self.staging is None or self.staging.shape != img.shape:
+                    self.staging = np.empty_like(img)
+                np.copyto(self.staging, img)
+                self.number = number
+                self.stamp = time.time() if stamp is None else stamp
+                self.cond.notify()
+
+    def encode(self):
+        """
+            Encode every new frame once and offer it to all the clients.
+        """
+        import cv2
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), self.quality]
+        while not self.stopped:
+            with self.cond:
+                while self.number == self.encoded and not self.stopped:
+                    self.cond.wait(0.5)
+                if self.stopped:
+                    return
+                with self.clients_lock:
+                    has_clients = bool(self.clients)
+                if not has_clients:
+                    # nobody is watching, skip the work
+                    self.encoded = self.number
+                    continue
+                number, stamp = self.number, self.stamp
+                # take the frame by swapping buffers, so publish() never waits on the encoder
+                self.staging, self.work = self.work, self.staging
+                self.encoded = number
+            img = self.work
+            if self.width and img.shape[1] != self.width:
+                h = img.shape[0] * self.width // img.shape[1]
+                if self.scaled is None or self.scaled.shape[:2] != (h, self.width):
+                    self.scaled = np.empty((h, self.width) + img.shape[2:], dtype=img.dtype)
+                cv2.resize(img, (self.width, h), dst=self.scaled, interpolation=cv2.INTER_AREA)
+                img = self.scaled
+            with metrics.span("relay.encode"):
+                ok, data = cv2.imencode('.jpg', img, params)
+            if not ok:
+                continue
+            packet = (number, stamp, data.tobytes())
+            with self.clients_lock:
+                self.clients = [c for c in self.clients if not c.closed]
+                for client in self.clients:
+                    client.offer(packet)
+            metrics.count("relay.frames")
+
+    def accept(self):
+        while not self.stopped:
+            try:
+                sock, addr = self.server.accept()
+            except OSError:
+                break
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            client = _Client(sock, addr)
+            with self.clients_lock:
+                self.clients.append(client)
+            Thread(target=client.run, name="relay-%s:%d" % addr, daemon=True).start()
+            print("Relay: viewer connected from %s:%d" % addr)
+
+    def stats(self):
+        """
+            Returns the sent/dropped frames and the lag of every connected client.
+        """
+        with self.clients_lock:
+            return [{'client': "%s:%d" % c.addr, 'sent': c.sent, 'dropped': c.dropped,
+                     'lag_ms': c.lag * 1e3, 'max_lag_ms': c.max_lag * 1e3}
+                    for c in self.clients if not c.closed]
+
+    def stop(self):
+        self.stopped = True
+        with self.cond:
+            self.cond.notify()
+        if self.server is not None:
+            self.server.close()
+        with self.clients_lock:
+            for client in self.clients:
+                client.close()
+
+
+class RelayClient:
+    """
+    A viewer of a FrameRelay, for the ground station and for tests.
+    """
+
+    def __init__(self, host='127.0.0.1', port=8766):
+        self.sock = socket.create_connection((host, port))
+        self.header = bytearray(HEADER.size)
+
+    def _read_into(self, buf):
+        view = memoryview(buf)
+        while view:
+            n = self.sock.recv_into(view)
+            if n == 0:
+                raise ConnectionError("relay closed the connection")
+            view = view[n:]
+
+    def read(self):
+        """
+            Returns the next (frame number, capture time, jpeg bytes).
+        """
+        self._read_into(self.header)
+        length, number, stamp = HEADER.unpack(self.header)
+        data = bytearray(length)
+        self._read_into(data)
+        return number, stamp, data
+
+    def read_image(self):
+        """
+            Returns the next (frame number, capture time, decoded BGR image).
+        """
+        import cv2
+        number, stamp, data = self.read()
+        return number, stamp, cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+    def close(self):
+        self.sock.close()
+
+
+def view(host, port):
+    """
+        Show a relayed stream in a window, with its lag.
+    """
+    import cv2
+    client = RelayClient(host, port)
+    while True:
+        number, stamp, img = client.read_image()
+        cv2.putText(img, "#%d lag %.0f ms" % (number, (time.time() - stamp) * 1e3), (10, 25),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        cv2.imshow("Relay %s:%d" % (host, port), img)
+        if cv2.waitKey(1) & 0xFF == ord('q'):
+            break
+    client.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['view'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+    view(args.host, args.port)
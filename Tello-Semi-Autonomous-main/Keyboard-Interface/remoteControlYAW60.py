@@ -1,32 +1,50 @@
 import time
+from time import perf_counter_ns
 from djitellopy import tello
 from threading import Thread
 import keyboard
 from logger import Logger
+from instrumentation import metrics, StartupTimer
 
 class MinimalSubscriber():
 
-    def __init__(self):
+    def __init__(self, startup=None):
+        """
+        @startup : a StartupTimer to record the phases into (the launcher passes its own).
+        """
+        self.startup = startup or StartupTimer()
         # Initialize logger and command state
         self.log = Logger("log1.csv")
         self.command = "stand"
         self.keyboard_thread = Thread(target=self.keyboard_control)
-        self.log_thread = Thread(target=self.log_update)
+        self.log_thread = Thread(target=self.log_update, daemon=True)
 
         # Connect to the Drone
         self.me = tello.Tello()
         self.me.connect()   
+        self.startup.mark("connect")
 
         # Print the Battery percentage
-        print("Battery percentage:", self.me.get_battery())
+        battery = self.me.get_battery()
+        print("Battery percentage:", battery)
         
-        if self.me.get_battery() < 10:
+        if battery < 10:
             raise RuntimeError("Tello rejected attempt to takeoff due to low Battery")
+        self.startup.mark("battery check")
+
+        # live metrics on http://127.0.0.1:8765/, a debug page must not keep the drone from flying
+        try:
+            metrics.serve()
+        except OSError as e:
+            print("Metrics page not started:", e)
 
         self.current_altitude = 0  # Track the current altitude
         self.initial_yaw = None    # Initial yaw to be set on takeoff
         self.yaw_target = 0        # Target yaw angle
         self.keyboard_thread.start()
+        self.log_thread.start()
+        self.startup.mark("keyboard control ready")
+        print(self.startup.report())
 
     def keyboard_control(self):
         """
@@ -37,10 +55,13 @@ class MinimalSubscriber():
         yaw_step = 60   # Yaw step in degrees for each key press
 
         while True:
+            tick = perf_counter_ns()
             if keyboard.is_pressed('esc'):
                 print("Exiting program.")
                 if tookoff:
                     self.me.land()
+                self.log.save_log()
+                metrics.dump("metrics1.txt")
                 break
 
             # Takeoff / Land
@@ -88,7 +109,9 @@ class MinimalSubscriber():
                 self.rotate_to_yaw(self.yaw_target)
 
             # Send the command to the drone
-            self.me.send_rc_control(0, 0, 0, 0)
+            with metrics.span("rc"):
+                self.me.send_rc_control(0, 0, 0, 0)
+            metrics.record("keyboard", perf_counter_ns() - tick)
 
     def move_to_height(self, target_height):
         """
@@ -97,15 +120,19 @@ class MinimalSubscriber():
         current_height = self.me.get_height()
         if target_height > current_height:
             while current_height < target_height:
-                self.me.send_rc_control(0, 0, 50, 0)  # Move upward
+                with metrics.span("rc"):
+                    self.me.send_rc_control(0, 0, 50, 0)  # Move upward
                 time.sleep(0.1)
                 current_height = self.me.get_height()
         elif target_height < current_height:
             while current_height > target_height:
-                self.me.send_rc_control(0, 0, -50, 0)  # Move downward
+                with metrics.span("rc"):
+                    self.me.send_rc_control(0, 0, -50, 0)  # Move downward
                 time.sleep(0.1)
                 current_height = self.me.get_height()
-        self.me.send_rc_control(0, 0, 0, 0)  # Stop movement
+        with metrics.span("rc"):
+            self.me.send_rc_control(0, 0, 0, 0)  # Stop movement
+        self.command = "stand"
         print(f"Reached desired height: {target_height} cm")
 
     def rotate_to_yaw(self, target_yaw):
@@ -121,22 +148,31 @@ class MinimalSubscriber():
         while abs(current_yaw - target_yaw) > 1:  # Small tolerance for reaching exact yaw
             current_yaw = self.me.get_yaw()
             if (target_yaw - current_yaw + 360) % 360 <= 180:
-                self.me.send_rc_control(0, 0, 0, yaw_speed)
+                with metrics.span("rc"):
+                    self.me.send_rc_control(0, 0, 0, yaw_speed)
             else:
-                self.me.send_rc_control(0, 0, 0, -yaw_speed)
+                with metrics.span("rc"):
+                    self.me.send_rc_control(0, 0, 0, -yaw_speed)
             time.sleep(0.1)
 
-        self.me.send_rc_control(0, 0, 0, 0)  # Stop rotation
+        with metrics.span("rc"):
+            self.me.send_rc_control(0, 0, 0, 0)  # Stop rotation
+        # the logged yaw segment ends with the turn, the archive measures the overshoot from there
+        self.command = "stand"
         print(f"Reached target yaw: {target_yaw} degrees")
 
     def log_update(self):
         """   
         Update the state of the drone into the log file.
         """
+        last = None
         while True:
             state = self.me.get_current_state()
-            if len(state) == 21:
+            # one row per state packet, djitellopy builds a new dict for each
+            if state is not last and len(state) == 21:
                 self.log.add(state, self.command, 0)
+                last = state
+            time.sleep(0.005)
 
 if __name__ == '__main__':
     tello = MinimalSubscriber()
@@ -0,0 +1,193 @@
+"""
+Re-run Aruco detection over recorded flights, on all cores.
+
+A flight is a directory with the frames/frame_N.jpg dumps of
+keyboardControl.log_update and, optionally, the Logger csv (log1.csv)
+that gives each frame number its time. The frames of all the flights are
+cut into chunks and spread over a process pool; each worker reads its
+files through mmap and decodes them straight to grayscale.
+
+    python reprocess.py flight1 flight2 --dict DICT_4X4_100 --param adaptiveThreshWinSizeMax=33
+
+Writes <flight>/detections.npz with one row per detected marker:
+    frame, time, id, corners (N x 4 x 2)
+and the per-frame columns frames, frame_times, counts.
+"""
+import argparse
+import mmap
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+FRAME_FILE = re.compile(r'frame_(\d+)\.jpg$')
+
+# set in every worker by _init_worker
+_detector = None
+
+
+def _init_worker(dict_name, params):
+    global _detector
+    import cv2
+    from marker_detector import MarkerDetector
+    # one process per core already, keep OpenCV from spawning its own threads
+    cv2.setNumThreads(1)
+    _detector = MarkerDetector(getattr(cv2.aruco, dict_name), **params)
+
+
+def _read_gray(path):
+    """
+        Decode a jpg to grayscale from a memory map of the file.
+    """
+    import cv2
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            data = np.frombuffer(m, dtype=np.uint8)
+            gray = cv2.imdecode(data, cv2.IMREAD_GRAYSCALE)
+            # the map cannot be closed while an array still points into it
+            del data
+    return gray
+
+
+def _process_chunk(flight, chunk):
+    """
+        Detect the markers of a chunk of (frame number, path).
+        Returns the flight, the rows, the frame counts and the worker timing.
+    """
+    start = time.perf_counter()
+    frames, ids, corners, counts = [], [], [], []
+    for number, path in chunk:
+        gray = _read_gray(path)
+        if gray is None:
+            continue
+        found_ids, found_corners = _detector.detect_gray(gray)
+        counts.append((number, len(found_ids)))
+        for marker_id, coord in zip(found_ids, found_corners):
+            frames.append(number)
+            ids.append(int(marker_id[0]))
+            corners.append(coord.reshape(4, 2))
+    return flight, (frames, ids, corners), counts, (os.getpid(), len(chunk), time.perf_counter() - start)
+
+
+def list_frames(flight):
+    """
+        Returns the sorted (frame number, path) of a flight.
+    """
+    folder = os.path.join(flight, 'frames')
+    if not os.path.isdir(folder):
+        folder = flight
+    frames = []
+    for name in os.listdir(folder):
+        m = FRAME_FILE.search(name)
+        if m:
+            frames.append((int(m.group(1)), os.path.join(folder, name)))
+    frames.sort()
+    return frames
+
+
+def frame_times(flight, log_name='log1.csv'):
+    """
+        Returns {frame number: time} from the flight's Logger csv, if there is one.
+    """
+    path = os.path.join(flight, log_name)
+    if not os.path.exists(path):
+        return {}
+    import pandas as pd
+    df = pd.read_csv(path, usecols=['time', 'frame#'])
+    # the first state logged with a frame number is the closest to its capture
+    first = df.groupby('frame#')['time'].min()
+    return dict(zip(first.index.to_numpy(), first.to_numpy()))
+
+
+def save(flight, rows, counts, times):
+    """
+        Write the merged detections of a flight as a compressed columnar file.
+    """
+    frames, ids, corners = rows
+    order = np.argsort(frames, kind='stable')
+    frames = np.asarray(frames, dtype=np.int64)[order]
+    counts = sorted(counts)
+    per_frame = np.array([n for n, _ in counts], dtype=np.int64)
+    out = os.path.join(flight, 'detections.npz')
+    np.savez_compressed(
+        out,
+        frame=frames,
+        time=np.array([times.get(n, np.nan) for n in frames], dtype=np.float64),
+        id=np.asarray(ids, dtype=np.int32)[order],
+        corners=np.asarray(corners, dtype=np.float32).reshape(-1, 4, 2)[order],
+        frames=per_frame,
+        frame_times=np.array([times.get(n, np.nan) for n in per_frame], dtype=np.float64),
+        counts=np.array([c for _, c in counts], dtype=np.int32),
+    )
+    return out
+
+
+def reprocess(flights, dict_name='DICT_4X4_100', params=None, workers=None, chunk_size=64):
+    """
+        Detect the markers of every frame of every flight in parallel.
+        Returns the written files and the frames/sec of every worker.
+    """
+    params = params or {}
+    tasks = []
+    for flight in flights:
+        frames = list_frames(flight)
+        tasks += [(flight, frames[i:i + chunk_size]) for i in range(0, len(frames), chunk_size)]
+
+    rows = {f: ([], [], []) for f in flights}
+    counts = {f: [] for f in flights}
+    per_worker = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(dict_name, params)) as pool:
+        futures = [pool.submit(_process_chunk, flight, chunk) for flight, chunk in tasks]
+        for future in futures:
+            flight, (frames, ids, corners), chunk_counts, (pid, n, elapsed) = future.result()
+            rows[flight][0].extend(frames)
+            rows[flight][1].extend(ids)
+            rows[flight][2].extend(corners)
+            counts[flight].extend(chunk_counts)
+            done, busy = per_worker.get(pid, (0, 0.0))
+            per_worker[pid] = (done + n, busy + elapsed)
+    wall = time.perf_counter() - start
+
+    outputs = [save(f, rows[f], counts[f], frame_times(f)) for f in flights]
+    rates = {pid: done / busy if busy else 0.0 for pid, (done, busy) in per_worker.items()}
+    total = sum(done for done, _ in per_worker.values())
+    return outputs, rates, total / wall if wall else 0.0
+
+
+def _param(text):
+    name, value = text.split('=', 1)
+    for cast in (int, float):
+        try:
+            return name, cast(value)
+        except ValueError:
+            pass
+    return name, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('flights', nargs='+', help="flight directories")
+    parser.add_argument('--dict', default='DICT_4X4_100', help="cv2.aruco dictionary name")
+    parser.add_argument('--param', action='append', default=[], type=_param,
+                        help="DetectorParameters override, name=value (repeatable)")
+    parser.add_argument('--workers', type=int, default=None, help="default: all cores")
+    parser.add_argument('--chunk', type=int, default=64, help="frames per task")
+    args = parser.parse_args()
+
+    outputs, rates, total = reprocess(args.flights, args.dict, dict(args.param), args.workers, args.chunk)
+    for pid, rate in sorted(rates.items()):
+        print("worker %d: %.1f frames/sec" % (pid, rate))
+    print("total: %.1f frames/sec" % total)
+    for out in outputs:
+        print("Saved to", out)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+import time
+from threading import Lock
+import numpy as np
+
+
+class SimFrameRead:
+    """
+    Stands in for djitellopy's BackgroundFrameRead.
+    Every access to `frame` hands out the next synthetic frame.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+        self.grabbed = True
+        self.stamps = {}
+
+    @property
+    def frame(self):
+        frame = self.frames[self.index % len(self.frames)]
+        self.index += 1
+        # remember when each frame object left the "decoder", for latency
+        self.stamps[id(frame)] = time.perf_counter()
+        return frame
+
+
+class SimTello:
+    """
+    A headless stand-in for djitellopy.Tello, for benchmarks and tests.
+    It models yaw/height rate from the last rc command and fakes the state packet.
+    """
+
+    def __init__(self, frames=None, battery=90):
+        """
+            Initialize.
+            @frames : a list of BGR frames the video stream cycles through.
+            @battery : the reported battery percentage.
+        """
+        if frames is None:
+            frames = [np.zeros((720, 960, 3), dtype=np.uint8)]
+        self.frame_read = SimFrameRead(frames)
+        self.battery = battery
+        self.lock = Lock()
+        self.yaw = 0.0
+        self.height = 0.0
+        self.rc = (0, 0, 0, 0)
+        self.last = time.perf_counter()
+        self.flying = False
+        self.rc_count = 0
+
+    def _step(self):
+        now = time.perf_counter()
+        dt = now - self.last
+        self.last = now
+        a, b, c, d = self.rc
+        # rc values are percent of max; ~100 deg/s yaw and ~100 cm/s climb at 100
+        self.yaw = (self.yaw + d * dt + 180) % 360 - 180
+        self.height = max(0.0, self.height + c * dt)
+
+    def connect(self):
+        pass
+
+    def streamon(self):
+        pass
+
+    def streamoff(self):
+        pass
+
+    def get_frame_read(self):
+        return self.frame_read
+
+    def get_battery(self):
+        return self.battery
+
+    def takeoff(self):
+        self.flying = True
+        self.height = 80.0
+
+    def land(self):
+        self.flying = False
+        self.height = 0.0
+
+    def emergency(self):
+        self.land()
+
+    def get_flying(self):
+        return self.flying
+
+    def send_rc_control(self, a, b, c, d):
+        with self.lock:
+            self._step()
+            self.rc = (a, b, c, d)
+            self.rc_count += 1
+
+    def get_yaw(self):
+        with self.lock:
+            self._step()
+            return int(self.yaw)
+
+    def get_height(self):
+        with self.lock:
+            self._step()
+            return int(self.height)
+
+    def get_current_state(self):
+        with self.lock:
+            self._step()
+            a, b, c, d = self.rc
+            return {'mid': -1, 'x': 0, 'y': 0, 'z': 0, 'mpry': '0,0,0',
+                    'pitch': 0, 'roll': 0, 'yaw': int(self.yaw),
+                    'vgx': b // 10, 'vgy': a // 10, 'vgz': -c // 10,
+                    'templ': 60, 'temph': 62, 'tof': int(self.height) + 10,
+                    'h': int(self.height), 'bat': self.battery, 'baro': 0.0,
+                    'time': 0, 'agx': 0.0, 'agy': 0.0, 'agz': -1000.0}
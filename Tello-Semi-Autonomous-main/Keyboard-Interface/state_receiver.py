@@ -0,0 +1,375 @@
+"""
+Typed receiver for the Tello state packets (UDP 8890).
+
+Every packet is parsed straight into one record of a preallocated
+structured NumPy ring, with its receive time. `latest()` and `history(n)`
+return views into the ring, nothing is copied.
+
+djitellopy binds 8890 itself, and it only keeps the packets that come
+from the drone's own address, so they cannot be passed on to it. Instead
+`receiver_tello` gives the flight scripts a Tello whose state getters
+(get_current_state, get_yaw, get_battery...) read the receiver, and the
+per-packet loops read `since(seq)` (see keyboardControl.log_update):
+
+    rx = StateReceiver().start()
+    me = receiver_tello(rx)
+    me.connect()
+
+Try it without a drone by replaying a Logger csv:
+
+    python state_receiver.py log1.csv
+"""
+import argparse
+import re
+import socket
+import time
+from threading import Thread
+from time import perf_counter_ns
+
+import numpy as np
+
+from instrumentation import Histogram, metrics
+
+STATE_PORT = 8890
+
+# every field the SDK 2.0 packet can carry, "mpry" is split into 3
+FIELDS = ['mid', 'x', 'y', 'z', 'mpry_p', 'mpry_r', 'mpry_y',
+          'pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph',
+          'tof', 'h', 'bat', 'baro', 'time', 'agx', 'agy', 'agz']
+FLOAT_FIELDS = {'baro', 'agx', 'agy', 'agz'}
+
+STATE_DTYPE = np.dtype([('seq', np.uint64), ('recv_time', np.float64)] +
+                       [(f, np.float32 if f in FLOAT_FIELDS else np.int32) for f in FIELDS])
+
+NUMBER = re.compile(rb'-?\d+(?:\.\d+)?')
+KEY = re.compile(rb'([a-z]+):')
+
+
+def format_packet(state: dict):
+    """
+        Encode a state dict (as djitellopy returns it) the way the drone sends it.
+    """
+    # SDK 2.0 always sends the mission pad fields, -1 and zeros when no pad is seen
+    defaults = {'mid': -1, 'mpry': '0,0,0'}
+    keys = ['mid', 'x', 'y', 'z', 'mpry',
+            'pitch', 'roll', 'yaw', 'vgx', 'vgy', 'vgz', 'templ', 'temph',
+            'tof', 'h', 'bat', 'baro', 'time', 'agx', 'agy', 'agz']
+    parts = []
+    for k in keys:
+        v = state.get(k, defaults.get(k, 0))
+        parts.append("%s:%s;" % (k, ("%.2f" % v) if k in FLOAT_FIELDS else v))
+    return ("".join(parts) + "\r\n").encode()
+
+
+class StateReceiver:
+
+    def __init__(self, capacity=4096, host='0.0.0.0', port=STATE_PORT):
+        """
+            Initialize.
+            @capacity : number of packets kept in the ring.
+            @host, @port : where to listen for the state packets.
+        """
+        self.capacity = capacity
+        # every record is written twice, at i and i + capacity,
+        # so any window of up to `capacity` packets is one contiguous slice
+        self.ring = np.zeros(2 * capacity, dtype=STATE_DTYPE)
+        self.seq = 0
+        self.malformed = 0
+        self.parse_ns = Histogram()
+
+        self.addr = (host, port)
+        self.sock = None
+        self.stopped = False
+        self.buf = bytearray(2048)
+
+        # packet layout: number position -> column, learned from the keys
+        self.layout = None
+        self.layout_len = -1
+        self.index = []
+        self.record = [0] * len(STATE_DTYPE.names)
+
+        # the djitellopy-style dict of the newest record, rebuilt once per packet
+        self.state_dict = {}
+        self.state_seq = 0
+
+    def _learn_layout(self, packet):
+        """
+            Map the numbers of a packet onto the record columns.
+        """
+        columns = []
+        for key in KEY.findall(packet):
+            key = key.decode()
+            if key == 'mpry':
+                columns += ['mpry_p', 'mpry_r', 'mpry_y']
+            elif key in STATE_DTYPE.names:
+                columns.append(key)
+            else:
+                return None
+        self.layout = columns
+        # positions of the parsed numbers in the record tuple
+        self.index = [STATE_DTYPE.names.index(c) for c in columns]
+        self.record = [0] * len(STATE_DTYPE.names)
+        self.layout_len = len(columns)
+        return columns
+
+    def parse(self, packet, recv_time):
+        """
+            Parse one raw packet (any bytes-like object) into the next ring slot.
+            Returns False if the packet was malformed.
+        """
+        start = perf_counter_ns()
+        numbers = NUMBER.findall(packet)
+        if len(numbers) != self.layout_len:
+            # first packet, or the drone switched mission pads on/off
+            self._learn_layout(packet)
+            if len(numbers) != self.layout_len:
+                self.malformed += 1
+                return False
+
+        record = self.record
+        record[0] = self.seq
+        record[1] = recv_time
+        for i, n in zip(self.index, numbers):
+            record[i] = float(n)
+        rec = tuple(record)
+        slot = self.seq % self.capacity
+        self.ring[slot] = rec
+        self.ring[slot + self.capacity] = rec
+        self.seq += 1
+
+        ns = perf_counter_ns() - start
+        self.parse_ns.record(ns)
+        metrics.record("state.parse", ns)
+        return True
+
+    def start(self):
+        """
+            Bind the socket and start the receiving deamon thread.
+        """
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.sock.bind(self.addr)
+        # the actual port, in case 0 was asked for
+        self.addr = self.sock.getsockname()
+        self.sock.settimeout(0.5)
+        Thread(target=self.update, name="state-rx", daemon=True).start()
+        return self
+
+    def update(self):
+        """
+            Receive packets into the reusable buffer and parse them.
+        """
+        view = memoryview(self.buf)
+        while not self.stopped:
+            try:
+                n = self.sock.recv_into(self.buf)
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.parse(view[:n], time.time())
+
+    def stop(self):
+        self.stopped = True
+        if self.sock is not None:
+            self.sock.close()
+
+    def latest(self):
+        """
+            Returns a view of the newest record, or None before the first packet.
+        """
+        if self.seq == 0:
+            return None
+        return self.ring[(self.seq - 1) % self.capacity + self.capacity]
+
+    def since(self, seq):
+        """
+            Returns a view of the records received from sequence number `seq` on,
+            and the sequence number to ask for next time. Past `capacity` records
+            behind, the oldest ones are gone.
+        """
+        end = self.seq
+        n = min(end - seq, self.capacity)
+        if n <= 0:
+            return self.ring[:0], end
+        stop = (end - 1) % self.capacity + self.capacity + 1
+        return self.ring[stop - n:stop], end
+
+    def field(self, key):
+        """
+            Returns one field of the newest record as djitellopy types it,
+            or None before the first packet or if the packets do not carry it.
+        """
+        rec = self.latest()
+        if rec is None:
+            return None
+        if key == 'mpry':
+            return self.state().get(key)
+        if key not in self.layout:
+            return None
+        return float(rec[key]) if key in FLOAT_FIELDS else int(rec[key])
+
+    def state(self):
+        """
+            Returns the newest record as djitellopy's get_current_state() does:
+            a dict of ints (floats for baro and the accelerations, "p,r,y" for mpry),
+            {} before the first packet. The same dict is returned until the next packet.
+            Only built when asked for, the flight code reads the ring itself.
+        """
+        seq = self.seq
+        if seq != self.state_seq:
+            rec = self.ring[(seq - 1) % self.capacity + self.capacity]
+            state = {}
+            for column in self.layout:
+                if column == 'mpry_p':
+                    state['mpry'] = "%d,%d,%d" % (rec['mpry_p'], rec['mpry_r'], rec['mpry_y'])
+                elif column not in ('mpry_r', 'mpry_y'):
+                    state[column] = float(rec[column]) if column in FLOAT_FIELDS else int(rec[column])
+            self.state_dict = state
+            self.state_seq = seq
+        return self.state_dict
+
+    def history(self, n=None):
+        """
+            Returns a view of the last n records (all kept records by default), oldest first.
+        """
+        kept = min(self.seq, self.capacity)
+        n = kept if n is None else min(n, kept)
+        end = (self.seq - 1) % self.capacity + self.capacity + 1 if self.seq else self.capacity
+        return self.ring[end - n:end]
+
+    def stats(self):
+        """
+            Returns the packet counts, estimated losses and parse cost.
+        """
+        h = self.history()
+        lost = 0
+        rate = 0.0
+        if len(h) > 1 and h['recv_time'][-1] > h['recv_time'][0]:
+            rate = (len(h) - 1) / (h['recv_time'][-1] - h['recv_time'][0])
+        if len(h) > 2:
+            gaps = np.diff(h['recv_time'])
+            period = np.median(gaps)
+            if period > 0:
+                # a gap of k periods means k - 1 packets never arrived
+                lost = int(np.clip(np.rint(gaps / period) - 1, 0, None).sum())
+        return {
+            'packets': self.seq,
+            'malformed': self.malformed,
+            'lost_estimate': lost,
+            'rate_hz': rate,
+            'parse_mean_us': self.parse_ns.total / self.parse_ns.n / 1e3 if self.parse_ns.n else 0.0,
+            'parse_p99_us': self.parse_ns.percentile(99) / 1e3,
+        }
+
+
+class StateReplayer:
+    """
+    Sends state packets to a local receiver, for tests and benchmarks.
+    """
+
+    def __init__(self, packets, host='127.0.0.1', port=STATE_PORT, rate=10.0, drop=0.0, seed=0):
+        """
+            Initialize.
+            @packets : raw packets (bytes) or state dicts to send, in order.
+            @rate : packets per second, 0 sends as fast as possible.
+            @drop : probability of skipping a packet, to test loss accounting.
+        """
+        self.packets = [p if isinstance(p, bytes) else format_packet(p) for p in packets]
+        self.addr = (host, port)
+        self.rate = rate
+        self.drop = drop
+        self.rng = np.random.default_rng(seed)
+        self.sent = 0
+        self.dropped = 0
+
+    @classmethod
+    def from_log(cls, filename: str, **kwargs):
+        """
+            Rebuild the packets of a csv saved by Logger.
+        """
+        import pandas as pd
+        df = pd.read_csv(filename)
+        packets = []
+        for row in df.itertuples(index=False):
+            packets.append({'pitch': row.pitch, 'roll': row.roll, 'yaw': row.Yaw, 'h': row.height,
+                            'vgx': row.Vx, 'vgy': row.Vy, 'vgz': row.Vz, 'bat': row.battery})
+        return cls(packets, **kwargs)
+
+    def run(self):
+        """
+            Send every packet, at the configured rate.
+        """
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        period = 1.0 / self.rate if self.rate else 0.0
+        next_time = time.perf_counter()
+        for packet in self.packets:
+            if self.drop and self.rng.random() < self.drop:
+                self.dropped += 1
+            else:
+                sock.sendto(packet, self.addr)
+                self.sent += 1
+            if period:
+                next_time += period
+                delay = next_time - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        sock.close()
+
+    def start(self):
+        t = Thread(target=self.run, name="state-replay", daemon=True)
+        t.start()
+        return t
+
+
+def receiver_tello(receiver, state_port=8891, **kwargs):
+    """
+        Returns a djitellopy Tello that reads its state from a StateReceiver.
+        @receiver : a started StateReceiver.
+        @state_port : where djitellopy's own state socket is moved to, out of the receiver's way.
+        @kwargs : passed on to tello.Tello (host...).
+    """
+    from djitellopy import tello
+
+    class ReceiverTello(tello.Tello):
+
+        def get_current_state(self):
+            return receiver.state()
+
+        def get_state_field(self, key):
+            # every get_<field>() of djitellopy goes through here, straight to the ring
+            value = receiver.field(key)
+            if value is None:
+                raise tello.TelloException('Could not get state property: {}'.format(key))
+            return value
+
+    tello.Tello.STATE_UDP_PORT = state_port
+    return ReceiverTello(**kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help="Logger csv to replay")
+    parser.add_argument('--port', type=int, default=STATE_PORT)
+    parser.add_argument('--rate', type=float, default=10.0, help="packets per second")
+    parser.add_argument('--drop', type=float, default=0.0, help="probability of dropping a packet")
+    args = parser.parse_args()
+
+    rx = StateReceiver(port=args.port).start()
+    # no connect(): the getters only need the state, not the command link
+    me = receiver_tello(rx)
+    replayer = StateReplayer.from_log(args.log, port=args.port, rate=args.rate, drop=args.drop)
+    sender = replayer.start()
+    while sender.is_alive():
+        time.sleep(1.0)
+        if rx.seq:
+            print("yaw %4d  height %4d  battery %3d%%  (%d packets)" % (
+                me.get_yaw(), me.get_height(), me.get_battery(), rx.seq))
+    time.sleep(0.2)
+    rx.stop()
+    print("sent %d, dropped %d" % (replayer.sent, replayer.dropped))
+    print(rx.stats())
+
+
+if __name__ == '__main__':
+    main()
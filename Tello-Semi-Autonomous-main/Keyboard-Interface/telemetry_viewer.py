@@ -0,0 +1,240 @@
+"""
+Level-of-detail viewer for long Logger logs.
+
+At save time every channel gets a min/max pyramid: level k holds the
+min and max of blocks of FACTOR**k samples. A query picks the level
+with no more buckets in the window than the screen has pixels, so any
+window comes back at screen resolution in the same time, however long
+the log is. Command changes and frame numbers are kept as event lists,
+with their times, and overlaid.
+
+    python telemetry_viewer.py log1.csv --t0 10 --t1 70 --out view.png
+    python telemetry_viewer.py log1.csv --bench 100
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+CHANNELS = ['pitch', 'roll', 'Yaw', 'height', 'Vx', 'Vy', 'Vz', 'battery']
+FACTOR = 4
+# stop building levels once they are this short
+MIN_LEVEL = 64
+
+
+def lod_path(filename: str):
+    """
+        The pyramid file saved next to a log.
+    """
+    return os.path.splitext(filename)[0] + '.lod.npz'
+
+
+def _reduce(values, fn):
+    pad = (-len(values)) % FACTOR
+    if pad:
+        # repeat the last sample so the last block is not skewed
+        values = np.concatenate((values, np.repeat(values[-1:], pad)))
+    return fn(values.reshape(-1, FACTOR), axis=1)
+
+
+def build_pyramid(df, filename: str):
+    """
+        Build the min/max pyramids of a Logger data frame and save them next to the log.
+    """
+    arrays = {'time': df['time'].to_numpy(dtype=np.float64)}
+    levels = 0
+    for ch in CHANNELS:
+        lo = hi = df[ch].to_numpy(dtype=np.float32)
+        arrays[ch + '.L0'] = lo
+        k = 0
+        while len(lo) > MIN_LEVEL:
+            k += 1
+            lo, hi = _reduce(lo, np.min), _reduce(hi, np.max)
+            arrays['%s.L%d.min' % (ch, k)] = lo
+            arrays['%s.L%d.max' % (ch, k)] = hi
+        levels = k
+    arrays['levels'] = np.array(levels)
+
+    # overlays: where the command changes, and where a new frame starts
+    commands = df['command'].astype(str).to_numpy().astype(str)
+    change = np.flatnonzero(np.concatenate(([True], commands[1:] != commands[:-1])))
+    arrays['command_index'] = change
+    arrays['command_time'] = arrays['time'][change]
+    arrays['command_label'] = commands[change]
+    frames = df['frame#'].to_numpy(dtype=np.int64)
+    new_frame = np.flatnonzero(np.concatenate(([True], frames[1:] != frames[:-1])))
+    arrays['frame_index'] = new_frame
+    arrays['frame_time'] = arrays['time'][new_frame]
+    arrays['frame_number'] = frames[new_frame]
+
+    path = lod_path(filename)
+    # not compressed: the viewer reads the arrays straight off the file
+    np.savez(path, **arrays)
+    return path
+
+
+class TelemetryView:
+
+    def __init__(self, path: str):
+        """
+            Initialize.
+            @path : a Logger csv (its .lod.npz is built if missing) or a .lod.npz.
+        """
+        if not path.endswith('.lod.npz'):
+            if not os.path.exists(lod_path(path)):
+                import pandas as pd
+                build_pyramid(pd.read_csv(path), path)
+            path = lod_path(path)
+        self.data = np.load(path)
+        self.cache = {}
+        self.time = self._get('time')
+        self.levels = int(self._get('levels'))
+
+    def _get(self, key):
+        # NpzFile re-reads a member on every access, keep what was read
+        arr = self.cache.get(key)
+        if arr is None:
+            arr = self.cache[key] = self.data[key]
+        return arr
+
+    def _event_times(self, kind):
+        key = kind + '_time'
+        if key not in self.cache and key not in self.data.files:
+            # pyramids saved before the event times were stored: gather them once
+            self.cache[key] = self.time[self._get(kind + '_index')]
+        return self._get(key)
+
+    def span(self):
+        """
+            Returns the (first, last) time of the log.
+        """
+        return float(self.time[0]), float(self.time[-1])
+
+    def query(self, channel, t0, t1, width):
+        """
+            Returns (bucket start times, mins, maxs) of a channel in [t0, t1],
+            with at most about `width` buckets.
+        """
+        i0 = int(np.searchsorted(self.time, t0, 'left'))
+        i1 = int(np.searchsorted(self.time, t1, 'right'))
+        n = max(i1 - i0, 1)
+        k = 0
+        while k < self.levels and n / FACTOR ** k > width:
+            k += 1
+        step = FACTOR ** k
+        b0, b1 = i0 // step, -(-i1 // step)
+        t = self.time[::step][b0:b1]
+        if k == 0:
+            values = self._get(channel + '.L0')[b0:b1]
+            return t, values, values
+        return (t, self._get('%s.L%d.min' % (channel, k))[b0:b1],
+                self._get('%s.L%d.max' % (channel, k))[b0:b1])
+
+    def events(self, kind, t0, t1, limit=50):
+        """
+            Returns (times, labels) of the 'command' changes or 'frame' starts in [t0, t1],
+            thinned out to at most `limit`.
+        """
+        labels = self._get('command_label' if kind == 'command' else 'frame_number')
+        times = self._event_times(kind)
+        j0, j1 = np.searchsorted(times, t0, 'left'), np.searchsorted(times, t1, 'right')
+        if j1 - j0 > limit:
+            pick = np.linspace(j0, j1 - 1, limit).astype(np.int64)
+            return times[pick], labels[pick]
+        return times[j0:j1], labels[j0:j1]
+
+    def render(self, t0=None, t1=None, width=1200, panel_height=90, channels=CHANNELS):
+        """
+            Draw the window into a BGR image, one panel per channel,
+            with the command changes and frame markers on top.
+        """
+        import cv2
+        first, last = self.span()
+        t0 = first if t0 is None else t0
+        t1 = last if t1 is None else t1
+        t1 = max(t1, t0 + 1e-6)
+        label_w = 70
+        plot_w = width - label_w
+        img = np.full((panel_height * len(channels) + 20, width, 3), 255, dtype=np.uint8)
+        rows = np.arange(panel_height)[:, None]
+
+        for p, ch in enumerate(channels):
+            t, lo, hi = self.query(ch, t0, t1, plot_w)
+            top = p * panel_height
+            cv2.putText(img, ch, (4, top + panel_height // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (0, 0, 0), 1)
+            cv2.line(img, (label_w, top + panel_height - 1), (width - 1, top + panel_height - 1), (220, 220, 220), 1)
+            if len(t) == 0:
+                continue
+            # fold the buckets into one min/max per pixel column
+            x = np.clip(((t - t0) / (t1 - t0) * plot_w).astype(np.int64), 0, plot_w - 1)
+            col_lo = np.full(plot_w, np.inf)
+            col_hi = np.full(plot_w, -np.inf)
+            np.minimum.at(col_lo, x, lo)
+            np.maximum.at(col_hi, x, hi)
+            filled = np.isfinite(col_lo)
+            if filled.sum() > 1:
+                # zoomed in past the samples: join them up
+                cols = np.arange(plot_w)
+                col_lo = np.interp(cols, cols[filled], col_lo[filled])
+                col_hi = np.interp(cols, cols[filled], col_hi[filled])
+                filled = (cols >= cols[filled][0]) & (cols <= cols[filled][-1])
+            vmin, vmax = np.min(lo), np.max(hi)
+            scale = (panel_height - 8) / (vmax - vmin) if vmax > vmin else 0.0
+            y_lo = (panel_height - 4 - (col_lo - vmin) * scale)
+            y_hi = (panel_height - 4 - (col_hi - vmin) * scale)
+            # one vectorized mask for the whole envelope
+            mask = (rows >= np.floor(y_hi) - 0.5) & (rows <= np.ceil(y_lo) + 0.5) & filled
+            img[top:top + panel_height, label_w:][mask] = (180, 90, 20)
+            cv2.putText(img, "%.0f" % vmax, (label_w - 40, top + 10), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (90, 90, 90), 1)
+            cv2.putText(img, "%.0f" % vmin, (label_w - 40, top + panel_height - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.3, (90, 90, 90), 1)
+
+        bottom = img.shape[0] - 20
+        times, labels = self.events('frame', t0, t1, limit=plot_w // 4)
+        for t in times:
+            x = label_w + int((t - t0) / (t1 - t0) * (plot_w - 1))
+            cv2.line(img, (x, bottom), (x, bottom + 6), (0, 140, 0), 1)
+        times, labels = self.events('command', t0, t1, limit=40)
+        for t, label in zip(times, labels):
+            x = label_w + int((t - t0) / (t1 - t0) * (plot_w - 1))
+            cv2.line(img, (x, 0), (x, bottom), (0, 0, 200), 1)
+            cv2.putText(img, str(label), (x + 2, bottom + 16), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 200), 1)
+        cv2.putText(img, "%.1f s - %.1f s" % (t0 - first, t1 - first), (4, bottom + 16),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.35, (0, 0, 0), 1)
+        return img
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help="Logger csv or .lod.npz")
+    parser.add_argument('--t0', type=float, default=None, help="seconds from the start")
+    parser.add_argument('--t1', type=float, default=None, help="seconds from the start")
+    parser.add_argument('--width', type=int, default=1200)
+    parser.add_argument('--out', default='telemetry.png')
+    parser.add_argument('--bench', type=int, default=0, help="time this many renders of random windows")
+    args = parser.parse_args()
+
+    import cv2
+    view = TelemetryView(args.log)
+    first, last = view.span()
+    t0 = first if args.t0 is None else first + args.t0
+    t1 = last if args.t1 is None else first + args.t1
+
+    if args.bench:
+        rng = np.random.default_rng(0)
+        samples = []
+        for _ in range(args.bench):
+            a, b = np.sort(rng.uniform(first, last, 2))
+            start = time.perf_counter()
+            view.render(a, b, args.width)
+            samples.append(time.perf_counter() - start)
+        samples = np.array(samples) * 1e3
+        print("%d rows, %d renders: mean %.2f ms, p95 %.2f ms, max %.2f ms" % (
+            len(view.time), args.bench, samples.mean(), np.percentile(samples, 95), samples.max()))
+
+    cv2.imwrite(args.out, view.render(t0, t1, args.width))
+    print("Saved to", args.out)
+
+
+if __name__ == '__main__':
+    main()